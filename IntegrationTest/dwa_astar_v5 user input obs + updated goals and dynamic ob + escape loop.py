@@ -182,6 +182,7 @@ def on_click(event):
             # Add new obstacle to the list
             new_obstacle = np.array([[event.xdata, event.ydata]])
             ob = np.append(ob, new_obstacle, axis=0)
+            a_star_planner.add_obstacles(new_obstacle)
             print(f"Added obstacle at: {event.xdata}, {event.ydata}")  # Debug statement
             circle = plt.Circle((event.xdata, event.ydata), 0.5, color="k")  # Adjust radius as needed
             plt.gca().add_patch(circle)
@@ -176,11 +176,12 @@ a_star_planner = a_star.AStarPlanner(
 
 # Function to add obstacles
 def on_click(event):
-    
+    global ob
     if event.button == 2:  # Left click
         if event.xdata is not None and event.ydata is not None:
             # Add new obstacle to the list
             ob = np.append(ob, [[event.xdata, event.ydata]], axis=0)
+            a_star_planner.add_obstacles([[event.xdata, event.ydata]])
             circle = plt.Circle((event.xdata, event.ydata), config.robot_radius, color="k")
             plt.gca().add_patch(circle)
             plt.draw()
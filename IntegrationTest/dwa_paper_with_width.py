@@ -20,6 +20,16 @@ from enum import Enum
 import matplotlib.pyplot as plt
 import numpy as np
 
+from dynamic_window_approach_paper import (calc_n_steps, calc_obstacle_index,
+                                           calc_horizon_steps,
+                                           calc_box_distance2,
+                                           calc_contact_distances,
+                                           calc_obstacle_costs,
+                                           calc_to_goal_costs,
+                                           first_contact_by_tracing,
+                                           first_contact_on_arcs,
+                                           predict_trajectories, rollout)
+
 show_animation = True
 save_animation_to_figs = False
 save_costs_fig = False
@@ -28,7 +38,7 @@ if save_costs_fig:
     to_goal_cost_list, speed_cost_list, ob_cost_list = [], [], []
 
 
-def dwa_control(x, config, goal, ob):
+def dwa_control(x, config, goal, ob, ob_index=None):
     """
     Dynamic Window Approach control
     Parameters:
@@ -39,6 +49,8 @@ def dwa_control(x, config, goal, ob):
             [x(m), y(m)]
         ob: obstacle positions
             [[x(m), y(m)], ...]
+        ob_index: ObstacleIndex of ob, optional. Build it once per obstacle
+            set so that collision checks only look at nearby obstacles.
     Returns:
         u: control input
             [v(m/s), omega(rad/s)]
@@ -47,7 +59,8 @@ def dwa_control(x, config, goal, ob):
     """
     dw = calc_dynamic_window(x, config)
 
-    u, trajectory = calc_control_and_trajectory(x, dw, config, goal, ob)
+    u, trajectory = calc_control_and_trajectory(x, dw, config, goal, ob,
+                                                ob_index)
 
     return u, trajectory
 
@@ -74,6 +87,26 @@ class Config:
         self.dt = 0.1  # [s] Time tick for motion prediction
         self.predict_time = 1.0  # [s]
         self.check_time = 100.0 # [s] Time to check for collision - a large number
+        # "analytic": first contact in closed form along each arc
+        # "simulate": step the motion model every dt up to check_time
+        # "trace": skip the steps that the clearance to the nearest
+        # obstacle proves free (sphere tracing)
+        self.collision_check = "analytic"
+        # [m] safety margin on the clearances of the "trace" check, on top
+        # of the error of a distance field
+        self.trace_tolerance = 1e-6
+        # obstacle cost below which an obstacle is ignored, so that each
+        # curve is only checked up to where neither its admissibility nor
+        # its obstacle cost can change by more than this; 0 to check up
+        # to check_time
+        self.obstacle_cost_saturation = 0.0
+        # grid resolution of the distance field that the simulated rollout
+        # reads clearances from, 0 to look them up exactly
+        self.distance_field_resolution = 0.0  # [m]
+        # number of headings of the configuration-space bitmaps that the
+        # simulated rollout looks poses up in, 0 to check every pose exactly
+        self.configuration_space_yaw_bins = 0
+        self.configuration_space_resolution = 0.1  # [m]
         self.to_goal_cost_gain = 0.2
         self.speed_cost_gain = 1
         self.obstacle_cost_gain = 0.1
@@ -178,9 +211,10 @@ def predict_trajectory(x_init, v, y, config):
     return trajectory
 
 
-def calc_control_and_trajectory(x, dw, config, goal, ob):
+def calc_control_and_trajectory(x, dw, config, goal, ob, ob_index=None):
     """
     calculation final input with dynamic window
+    All samples of the window are evaluated at once with array operations.
     Parameters:
         x: current state
             [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
@@ -191,6 +225,7 @@ def calc_control_and_trajectory(x, dw, config, goal, ob):
             [x(m), y(m)]
         ob: obstacle positions 
             [[x(m), y(m)], ...]
+        ob_index: ObstacleIndex of ob, optional
     Returns:
         best_u: selected control input
             [v(m/s), omega(rad/s)]
@@ -198,50 +233,50 @@ def calc_control_and_trajectory(x, dw, config, goal, ob):
             [[x, y, yaw, v, omega], ...]
     """
 
-    min_cost = float("inf")
-    best_u = [0.0, 0.0]
-    best_trajectory = np.array([x])
-
-    # evaluate all trajectory with sampled input in dynamic window
-    for v in np.arange(dw[0], dw[1], config.v_resolution):
-        for y in np.arange(dw[2], dw[3], config.yaw_rate_resolution):
-
-            # admissible velocities check
-            dist, _ = closest_obstacle_on_curve(x.copy(), ob, v, y, config)
-            if v > math.sqrt(2*config.max_accel*dist):
-                continue
-            # if y > math.sqrt(2*config.max_delta_yaw_rate*dist):
-            #     continue
-
-            trajectory = predict_trajectory(x.copy(), v, y, config)
-            # calc cost
-            to_goal_cost = config.to_goal_cost_gain * calc_to_goal_cost(trajectory, goal)
-            speed_cost = config.speed_cost_gain * (config.max_speed - trajectory[-1, 3])
-            if dist == 0:
-                ob_cost = float("Inf")
-            else:
-                ob_cost = config.obstacle_cost_gain * (1 / dist)
-
-            final_cost = to_goal_cost + speed_cost + ob_cost
-
-            # search minimum trajectory
-            if min_cost >= final_cost:
-                min_cost = final_cost
-                best_u = [v, y]
-                best_trajectory = trajectory
-
-                if save_costs_fig:
-                    to_goal_cost_list.append(to_goal_cost)
-                    speed_cost_list.append(speed_cost)
-                    ob_cost_list.append(ob_cost)
-
-                if abs(best_u[0]) < config.robot_stuck_flag_cons \
-                        and abs(x[3]) < config.robot_stuck_flag_cons:
-                    # to ensure the robot do not get stuck in
-                    # best v=0 m/s (in front of an obstacle) and
-                    # best omega=0 rad/s (heading to the goal with
-                    # angle difference of 0)
-                    best_u[1] = -config.max_delta_yaw_rate
+    # sampled inputs in dynamic window, in the order of a v-major scan
+    v, y = np.meshgrid(np.arange(dw[0], dw[1], config.v_resolution),
+                       np.arange(dw[2], dw[3], config.yaw_rate_resolution),
+                       indexing="ij")
+    v, y = v.ravel(), y.ravel()
+
+    # admissible velocities check
+    dist = closest_obstacle_on_curves(x, ob, v, y, config, ob_index)
+    admissible = ~(v > np.sqrt(2*config.max_accel*dist))
+    # if y > math.sqrt(2*config.max_delta_yaw_rate*dist):
+    #     continue
+    v, y, dist = v[admissible], y[admissible], dist[admissible]
+    if len(v) == 0:
+        return [0.0, 0.0], np.array([x])
+
+    trajectories = predict_trajectories(x, v, y, config)
+    # calc cost
+    to_goal_cost = config.to_goal_cost_gain * calc_to_goal_costs(trajectories, goal)
+    speed_cost = config.speed_cost_gain * (config.max_speed - trajectories[:, -1, 3])
+    ob_cost = calc_obstacle_costs(dist, config)
+
+    final_cost = to_goal_cost + speed_cost + ob_cost
+
+    # search minimum trajectory: the last sample of minimum cost, as a
+    # scan keeping the sample whenever min_cost >= final_cost would
+    best = len(final_cost) - 1 - np.argmin(final_cost[::-1])
+    best_u = [v[best], y[best]]
+    best_trajectory = trajectories[best]
+
+    if save_costs_fig:
+        # costs of every sample such a scan would have kept on its way
+        prev_min = np.minimum.accumulate(np.concatenate(([np.inf], final_cost[:-1])))
+        kept = final_cost <= prev_min
+        to_goal_cost_list.extend(to_goal_cost[kept])
+        speed_cost_list.extend(speed_cost[kept])
+        ob_cost_list.extend(ob_cost[kept])
+
+    if abs(best_u[0]) < config.robot_stuck_flag_cons \
+            and abs(x[3]) < config.robot_stuck_flag_cons:
+        # to ensure the robot do not get stuck in
+        # best v=0 m/s (in front of an obstacle) and
+        # best omega=0 rad/s (heading to the goal with
+        # angle difference of 0)
+        best_u[1] = -config.max_delta_yaw_rate
     return best_u, best_trajectory
 
 
@@ -262,12 +297,13 @@ def any_circle_overlap_with_box(circles, center, length, width, rot):
     # Translate circle centers so that the center of the box is at the origin
     translated_circles = circles[:, :2] - np.array(center)
     
-    # Rotation matrix for the negative of the box's rotation angle
-    cos_rot = np.cos(-rot)
-    sin_rot = np.sin(-rot)
+    # Rotation matrix for the box's rotation angle
+    cos_rot = np.cos(rot)
+    sin_rot = np.sin(rot)
     rotation_matrix = np.array([[cos_rot, -sin_rot], [sin_rot, cos_rot]])
 
-    # Rotate all circle centers using matrix multiplication
+    # Rotate all circle centers by the negative of the box's rotation angle,
+    # multiplying the rows of centers by the rotation matrix
     rotated_centers = translated_circles @ rotation_matrix
 
     # Half dimensions of the box
@@ -288,7 +324,54 @@ def any_circle_overlap_with_box(circles, center, length, width, rot):
     return np.any(overlap)
 
 
-def closest_obstacle_on_curve(x, ob, v, omega, config):
+def any_circles_overlap_with_boxes(circles, px, py, yaw, length, width,
+                                   ob_index=None):
+    """
+    any_circle_overlap_with_box for many boxes of the same size at once
+
+    Parameters:
+    - circles: 2D numpy array, shape (N, 3), (x, y, radius) of each circle
+    - px, py, yaw: 1D numpy arrays, shape (M,), center and rotational angle
+      of each box
+    - length: float, length of the boxes
+    - width: float, width of the boxes
+    - ob_index: ObstacleIndex of the circle centers, optional. With it, each
+      box is only checked against the circles near it, or looked up in the
+      bitmaps of a ConfigurationSpace if the circles share one radius.
+
+    Returns:
+    - Boolean array, shape (M,): True where any circle overlaps with the box
+    """
+    half_length = length / 2
+    half_width = width / 2
+    overlap = np.zeros(len(px), dtype=bool)
+    if len(circles) == 0:
+        return overlap
+
+    if ob_index is not None and np.all(circles[:, 2] == circles[0, 2]):
+        return ob_index.calc_hits(px, py, yaw,
+                                  (half_length, half_width, circles[0, 2]))
+    elif ob_index is not None:
+        reach = math.hypot(half_length, half_width) + circles[:, 2].max()
+        box, near = ob_index.query_pairs(np.stack((px, py), axis=1), reach)
+        distances = np.sqrt(calc_box_distance2(
+            circles[near, :2], px[box], py[box], yaw[box],
+            half_length, half_width))
+        overlap[box[distances <= circles[near, 2]]] = True
+        return overlap
+
+    # every circle against a chunk of boxes at a time
+    chunk = max(1, (1 << 20) // len(circles))
+    for start in range(0, len(px), chunk):
+        boxes = slice(start, start + chunk)
+        distances = np.sqrt(calc_box_distance2(
+            circles[None, :, :2], px[boxes, None], py[boxes, None],
+            yaw[boxes, None], half_length, half_width))
+        overlap[boxes] = np.any(distances <= circles[:, 2], axis=1)
+    return overlap
+
+
+def closest_obstacle_on_curve(x, ob, v, omega, config, ob_index=None):
     """
     Calculate the distance to the closest obstacle that intersects with the curvature
     Parameters:
@@ -299,27 +382,140 @@ def closest_obstacle_on_curve(x, ob, v, omega, config):
         v: translational velocity (m/s)
         omega: angular velocity (rad/s)
         config: simulation configuration
+        ob_index: ObstacleIndex of ob, optional. With it, only the obstacles
+            near the robot are checked.
     Returns:
         dist: distance to the closest obstacle
         t: time to reach the closest obstacle
     """
-    t = 0
-    dist = 0
-    while t < config.check_time:
-        x = motion(x, [v, omega], config.dt)
-        if config.robot_type == RobotType.rectangle:
-            ob_with_radius = np.concatenate([ob, np.full((len(ob), 1), config.obstacle_radius)], axis=1)
-            if any_circle_overlap_with_box(ob_with_radius, x[:2], config.robot_length, config.robot_width, x[2]):
-                return dist, t
-        elif config.robot_type == RobotType.circle:
-            distances = np.linalg.norm(ob - x[:2], axis=1)
-            if np.any(distances <= config.robot_radius):
-                return dist, t
-        else:
-            raise ValueError("Invalid robot type")
-        t += config.dt
-        dist += v * config.dt
-    return float("Inf"), float("Inf")
+    n_steps = calc_horizon_steps(
+        np.array([v]), config,
+        calc_n_steps(config.check_time, config.dt, inclusive=False))
+    first = first_contact_on_curves(x, ob, np.array([v]), np.array([omega]),
+                                    n_steps, config, ob_index)[0]
+    if first == n_steps[0]:
+        return float("Inf"), float("Inf")
+    # accumulated step by step
+    increments = np.zeros((2, first + 1))
+    increments[:, 1:] = [[v * config.dt], [config.dt]]
+    dist, t = np.cumsum(increments, axis=1)[:, -1]
+    return dist, t
+
+
+def closest_obstacle_on_curves(x, ob, v, omega, config, ob_index=None):
+    """
+    closest_obstacle_on_curve for many inputs at once
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        config: simulation configuration
+        ob_index: ObstacleIndex of ob, optional
+    Returns:
+        dist: distance to the closest obstacle of each input, shape (n,)
+    """
+    n_steps = calc_horizon_steps(
+        v, config, calc_n_steps(config.check_time, config.dt, inclusive=False))
+    first = first_contact_on_curves(x, ob, v, omega, n_steps, config, ob_index)
+    return calc_contact_distances(first, n_steps, v, config.dt)
+
+
+def first_contact_on_curves(x, ob, v, omega, n_steps, config, ob_index=None):
+    """
+    first colliding step of many inputs with the collision check of config
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        n_steps: number of steps to check of each input, shape (n,)
+        config: simulation configuration
+        ob_index: ObstacleIndex of ob, optional
+    Returns:
+        first: index of the first colliding step of each input (0 for the
+            first step), n_steps if there is none
+    """
+    footprint = calc_footprint(config)
+    if config.collision_check == "analytic":
+        return first_contact_on_arcs(x, ob, v, omega, config.dt,
+                                     n_steps.max(initial=0), footprint,
+                                     ob_index)
+    elif config.collision_check == "trace":
+        return first_contact_by_tracing(x, ob, v, omega, config.dt, n_steps,
+                                        footprint, ob_index,
+                                        config.trace_tolerance)
+    elif config.collision_check == "simulate":
+        half_length, half_width, radius = footprint
+        # obstacle circles, with their radius added once for all poses
+        if ob_index is not None:
+            ob = ob_index.ob
+        circles = np.concatenate([ob, np.full((len(ob), 1), radius)], axis=1)
+        return first_contact_with_circles(x, circles, v, omega, config.dt,
+                                          n_steps, 2 * half_length,
+                                          2 * half_width, ob_index)
+    else:
+        raise ValueError("Invalid collision check")
+
+
+def first_contact_with_circles(x, circles, v, omega, dt, n_steps, length,
+                               width, ob_index=None):
+    """
+    first step of many inputs at which the robot box overlaps a circle
+    All poses of all inputs are rolled out with motion and checked in one
+    pass of any_circles_overlap_with_boxes.
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        circles: (N, 3) array of circles (x, y, radius)
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        dt: time interval (s)
+        n_steps: number of steps to check, or one per input
+        length: length of the box (m)
+        width: width of the box (m)
+        ob_index: ObstacleIndex of the circle centers, optional
+    Returns:
+        first: index of the first colliding step of each input (0 for the
+            first step), n_steps if there is none
+    """
+    n_steps = np.broadcast_to(n_steps, len(v))
+    first = n_steps.copy()
+    n = n_steps.max(initial=0)
+    if n == 0 or len(circles) == 0:
+        return first
+    px, py, yaw = rollout(x[:3], v, omega, dt, n)
+    hit = any_circles_overlap_with_boxes(
+        circles, px.ravel(), py.ravel(), yaw.ravel(), length, width,
+        ob_index).reshape(px.shape)
+    hit &= np.arange(n) < n_steps[:, None]
+    collided = hit.any(axis=1)
+    first[collided] = np.argmax(hit[collided], axis=1)
+    return first
+
+
+def calc_footprint(config):
+    """
+    collision footprint of the robot
+    The robot collides with the obstacles within radius of a
+    (2 * half_length) x (2 * half_width) box around it, aligned with its
+    heading.
+    Parameters:
+        config: simulation configuration
+    Returns:
+        footprint: (half_length(m), half_width(m), radius(m))
+    """
+    if config.robot_type == RobotType.rectangle:
+        return (config.robot_length / 2, config.robot_width / 2,
+                config.obstacle_radius)
+    elif config.robot_type == RobotType.circle:
+        return 0.0, 0.0, config.robot_radius
+    else:
+        raise ValueError("Invalid robot type")
 
 
 def calc_to_goal_cost(trajectory, goal):
@@ -404,8 +600,9 @@ def dwa(x, goal, ob, config):
         fig_path = os.path.join(fig_dir, 'frame_{}.png'.format(i_fig))
 
     trajectory = np.array(x)
+    ob_index = calc_obstacle_index(ob, config, calc_footprint(config))
     while True:
-        u, predicted_trajectory = dwa_control(x, config, goal, ob)
+        u, predicted_trajectory = dwa_control(x, config, goal, ob, ob_index)
         x = motion(x, u, config.dt)  # simulate robot
         trajectory = np.vstack((trajectory, x))  # store state history
 
@@ -0,0 +1,272 @@
+"""
+
+Precomputed route tables for the GUI waypoint lattice
+
+The GUI only accepts start and goal points that are multiples of 5 inside
+the 60 m x 60 m maps of Maps_2, so every query starts and ends on one of a
+small, fixed set of lattice cells. For each map, one single-source search
+per lattice cell is run offline over the A* grid, and the distances and
+next-hop cells are stored on disk. A GUI query is then a walk through the
+next-hop table with no search at runtime.
+
+The tables are built on first use and are not tracked in git; a stored
+table whose key no longer matches its map, grid or lattice is rebuilt.
+
+Run this file to (re)build the tables of every map in Maps_2:
+
+    python route_table.py
+
+"""
+
+import hashlib
+import os
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+
+import a_star
+
+maps_dir = os.path.join(os.path.dirname(__file__), "Maps_2")
+tables_dir = os.path.join(os.path.dirname(__file__), "route_tables")
+
+# start and goal coordinates accepted by the GUI [m]
+lattice = np.arange(5.0, 60.0, 5.0)
+
+
+def load_map(map_file):
+    """
+    Obstacles of a Maps_2 map file, the same way test_dwa_astar_v5.py
+    loads them
+
+    :return: ob, ox, oy
+    """
+    with open(map_file, 'r') as file:
+        map_code = file.read()
+    scope = {"np": np, "ox": [], "oy": [], "is_ob": 0}
+    exec(map_code, scope)
+    ox, oy = scope["ox"], scope["oy"]
+    if scope["is_ob"] == 1:
+        ob = scope["ob"]
+    else:
+        ob = np.array([ox, oy]).transpose()
+    return np.asarray(ob, dtype=float), ox, oy
+
+
+class RouteTable:
+
+    def __init__(self, planner, lattice_x=lattice, lattice_y=lattice):
+        """
+        Search the grid of planner once from every lattice cell
+
+        planner: AStarPlanner whose grid and motion model are used
+        lattice_x: x positions of the lattice [m]
+        lattice_y: y positions of the lattice [m]
+        """
+        self.planner = planner
+        self.lattice_x = np.asarray(lattice_x, dtype=float)
+        self.lattice_y = np.asarray(lattice_y, dtype=float)
+        self.grid_version = planner.grid_version
+        self.lattice_ids = None
+        self.distance = None
+        self.next_hop = None
+        self.calc_tables()
+
+    def calc_tables(self):
+        planner = self.planner
+        lx, ly = np.meshgrid(self.lattice_x, self.lattice_y, indexing="ij")
+        ix = np.round((lx.ravel() - planner.min_x) / planner.resolution)
+        iy = np.round((ly.ravel() - planner.min_y) / planner.resolution)
+        self.lattice_ids = planner.calc_grid_index(
+            ix.astype(int), iy.astype(int))
+
+        # searching the reversed graph from each lattice cell gives, for
+        # every cell, its cost to that lattice cell and the next cell on
+        # the way there
+        cost, pred = dijkstra(self.calc_grid_graph().T,
+                              indices=self.lattice_ids,
+                              return_predecessors=True)
+        # distance[i, j]: path cost from lattice cell i to lattice cell j
+        self.distance = cost[:, self.lattice_ids].T
+        # next_hop[j, c]: next cell from cell c towards lattice cell j
+        self.next_hop = pred.astype(np.int32)
+
+    def calc_grid_graph(self):
+        # directed moves of the A* motion model, into free cells only
+        planner = self.planner
+        x_limit, y_limit = planner.calc_index_limit()
+        cx, cy = np.meshgrid(np.arange(x_limit), np.arange(y_limit),
+                             indexing="ij")
+        cx, cy = cx.ravel(), cy.ravel()
+        rows, cols, costs = [], [], []
+        for dx, dy, cost in planner.motion:
+            nx, ny = cx + dx, cy + dy
+            ok = (0 <= nx) & (nx < x_limit) & (0 <= ny) & (ny < y_limit)
+            ok[ok] = ~planner.obstacle_map[nx[ok], ny[ok]]
+            rows.append(planner.calc_grid_index(cx[ok], cy[ok]))
+            cols.append(planner.calc_grid_index(nx[ok], ny[ok]))
+            costs.append(np.full(np.count_nonzero(ok), cost))
+        n = planner.x_width * planner.y_width
+        return coo_matrix((np.concatenate(costs),
+                           (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(n, n)).tocsr()
+
+    def calc_lattice_index(self, x, y):
+        # index into the lattice cells, None if (x, y) is not on the lattice
+        i = np.flatnonzero(np.isclose(self.lattice_x, x))
+        j = np.flatnonzero(np.isclose(self.lattice_y, y))
+        if len(i) == 0 or len(j) == 0:
+            return None
+        return int(i[0]) * len(self.lattice_y) + int(j[0])
+
+    def planning(self, sx, sy, gx, gy):
+        """
+        Path between two lattice points read from the tables
+
+        Falls back to planner.planning if a point is off the lattice or the
+        obstacles changed since the tables were built.
+
+        The path has the same cost as the one of planner.planning, but where
+        several paths tie on cost the two may pass through different cells:
+        Dijkstra keeps the first predecessor it settles, A* the first node it
+        pops under its heuristic.
+
+        input:
+            s_x: start x position [m]
+            s_y: start y position [m]
+            gx: goal x position [m]
+            gy: goal y position [m]
+
+        output:
+            rx: x position list of the final path
+            ry: y position list of the final path
+        """
+        s_index = self.calc_lattice_index(sx, sy)
+        g_index = self.calc_lattice_index(gx, gy)
+        if (s_index is None or g_index is None
+                or self.grid_version != self.planner.grid_version):
+            return self.planner.planning(sx, sy, gx, gy)
+
+        planner = self.planner
+        g_id = int(self.lattice_ids[g_index])
+        if not np.isfinite(self.distance[s_index, g_index]):
+            print("Open set is empty..")
+            return planner.calc_final_path(g_id, None)
+
+        path = [int(self.lattice_ids[s_index])]
+        while path[-1] != g_id:
+            path.append(int(self.next_hop[g_index, path[-1]]))
+
+        # goal first, like AStarPlanner.planning
+        rx, ry = [], []
+        for c_id in reversed(path):
+            ix, iy = divmod(c_id, planner.y_width)
+            rx.append(planner.calc_grid_position(ix, planner.min_x))
+            ry.append(planner.calc_grid_position(iy, planner.min_y))
+
+        return rx, ry
+
+    def save(self, table_file):
+        np.savez_compressed(
+            table_file, key=np.frombuffer(
+                calc_table_key(self.planner, self.lattice_x, self.lattice_y),
+                dtype=np.uint8),
+            lattice_ids=self.lattice_ids, distance=self.distance,
+            next_hop=self.next_hop)
+
+    @classmethod
+    def load(cls, table_file, planner, lattice_x=lattice, lattice_y=lattice):
+        """
+        Route table stored by save()
+
+        :return: RouteTable, None if the file is missing or was built for a
+            different map, grid or lattice
+        """
+        if not os.path.exists(table_file):
+            return None
+        key = calc_table_key(planner, lattice_x, lattice_y)
+        with np.load(table_file) as data:
+            if data["key"].tobytes() != key:
+                return None
+            table = cls.__new__(cls)
+            table.planner = planner
+            table.lattice_x = np.asarray(lattice_x, dtype=float)
+            table.lattice_y = np.asarray(lattice_y, dtype=float)
+            table.grid_version = planner.grid_version
+            table.lattice_ids = data["lattice_ids"]
+            table.distance = data["distance"]
+            table.next_hop = data["next_hop"]
+        return table
+
+
+def calc_table_key(planner, lattice_x, lattice_y):
+    # digest of everything the tables depend on
+    key = hashlib.sha1()
+    key.update(np.asarray([planner.resolution, planner.rr,
+                           planner.min_x, planner.min_y,
+                           planner.max_x, planner.max_y], dtype=float))
+    key.update(np.ascontiguousarray(planner.obstacle_map))
+    key.update(np.asarray(lattice_x, dtype=float))
+    key.update(np.asarray(lattice_y, dtype=float))
+    return key.digest()
+
+
+def calc_table_file(selected_map):
+    return os.path.join(tables_dir, f"{selected_map}.npz")
+
+
+def make_planner(ob, ox, oy, resolution=5.0, rr=1.0):
+    """
+    A* planner with the grid that test_dwa_astar_v5.py builds for any
+    lattice start and goal
+    """
+    return a_star.AStarPlanner(
+        ob, resolution=resolution, rr=rr,
+        min_x=min(*ox, lattice[0] - 2), min_y=min(*oy, lattice[0] - 2),
+        max_x=max(*ox, lattice[-1] + 2), max_y=max(*oy, lattice[-1] + 2)
+    )
+
+
+def load_route_table(selected_map, planner):
+    """
+    Stored route table of a map in Maps_2 for planner, built and stored
+    first if it is missing or out of date
+    """
+    table_file = calc_table_file(selected_map)
+    table = RouteTable.load(table_file, planner)
+    if table is None:
+        table = RouteTable(planner)
+        os.makedirs(tables_dir, exist_ok=True)
+        table.save(table_file)
+    return table
+
+
+def main():
+    print(__file__ + " start!!")
+    a_star.show_animation = False
+
+    for name in sorted(os.listdir(maps_dir)):
+        if not name.endswith(".txt"):
+            continue
+        selected_map = name[:-len(".txt")]
+        try:
+            ob, ox, oy = load_map(os.path.join(maps_dir, name))
+        except Exception as e:
+            print(f"Skipping '{name}'. Reason: {str(e)}")
+            continue
+        if len(ox) == 0:
+            # the lattice grid bounds need the map border in ox, oy
+            print(f"Skipping '{name}'. Reason: no map border")
+            continue
+
+        planner = make_planner(ob, ox, oy)
+        table = RouteTable(planner)
+        os.makedirs(tables_dir, exist_ok=True)
+        table.save(calc_table_file(selected_map))
+        n_reachable = np.count_nonzero(np.isfinite(table.distance))
+        print(f"{selected_map}: {n_reachable}/{table.distance.size} "
+              "lattice pairs reachable")
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,7 @@ sys.path.append(rpath)
 #from PathPlanning.DynamicWindowApproach import dwa_paper_with_width as dwa
 import dwa_paper_with_width as dwa
 import a_star as a_star
+import route_table
 #import a_star_v2 as a_star
 
 # Removes socket error with PyQt5
@@ -281,7 +282,10 @@ a_star_planner = a_star.AStarPlanner(
     min_x=min(*ox, sx-2, gx-2), min_y=min(*oy, sy-2, gy-2),
     max_x=max(*ox, sx+2, gx+2), max_y=max(*oy, sy+2, gy+2)
 )
-rx, ry = a_star_planner.planning(sx, sy, gx, gy)
+# GUI start and goal points lie on the 5 m lattice: read the path from the
+# map's precomputed route table (built on first use, see route_table.py)
+rx, ry = route_table.load_route_table(
+    selected_map, a_star_planner).planning(sx, sy, gx, gy)
 
 # Start- Wen Ci----------------------------------------------------------------------------------------------------------------------
 # To plot a line for global path
@@ -408,6 +412,8 @@ x = np.array([sx, sy, math.pi / 8.0, 1.0, 0.0])
 
 print(__file__ + " start!!")
 trajectory = np.array(x)
+# the obstacles stay the same from here on
+ob_index = dwa.calc_obstacle_index(ob, config, dwa.calc_footprint(config))
 
 #Function to write the loca distances, global distances and coordinates to text file
 def write_data_to_file(filename, global_distance, local_distance, coordinates):
@@ -475,7 +481,7 @@ for i_goal, dwagoal in enumerate(road_map):
 # End- Wen Ci--------------------------------------------------------------------------------------------------------------------------------------------
 
     while True:
-        u, predicted_trajectory = dwa.dwa_control(x, config, dwagoal, ob)
+        u, predicted_trajectory = dwa.dwa_control(x, config, dwagoal, ob, ob_index)
         x = dwa.motion(x, u, config.dt)  # simulate robot
         trajectory = np.vstack((trajectory, x))  # store state history
 
@@ -9,10 +9,20 @@ See Wikipedia article (https://en.wikipedia.org/wiki/A*_search_algorithm)
 
 """
 
+import contextlib
+import heapq
+import io
 import math
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
 
 import matplotlib.pyplot as plt
 import numpy as np
+from scipy.spatial import cKDTree
 
 show_animation = True
 
@@ -21,7 +31,8 @@ class AStarPlanner:
 
     def __init__(
         self, ob, resolution, rr, 
-        min_x=None, min_y=None, max_x=None, max_y=None
+        min_x=None, min_y=None, max_x=None, max_y=None, path_cache_size=256,
+        distance_field=None
     ):
         """
         Initialize grid map for a star planning
@@ -30,6 +41,13 @@ class AStarPlanner:
         oy: y position list of Obstacles [m]
         resolution: grid resolution [m]
         rr: robot radius[m]
+        path_cache_size: number of planned paths kept for repeated queries,
+            0 disables the cache
+        distance_field: optional DistanceField of ob (see
+            dynamic_window_approach_paper.py) to inflate the obstacles from,
+            instead of searching the obstacles around every cell. Exact when
+            the cell positions are nodes of the field and rr is below its
+            max_distance. Obstacles cannot be removed from such a planner.
         """
 
         self.ob=ob
@@ -40,19 +58,15 @@ class AStarPlanner:
         self.obstacle_map = None
         self.x_width, self.y_width = 0, 0
         self.motion = self.get_motion_model()
+        # bumped whenever the occupancy of a cell changes
+        self.grid_version = 0
+        # least recently used first: (grid version, start id, goal id) ->
+        # (rx, ry)
+        self.path_cache = OrderedDict()
+        self.path_cache_size = path_cache_size
+        self.distance_field = distance_field
         self.calc_obstacle_map()
 
-    class Node:
-        def __init__(self, x, y, cost, parent_index):
-            self.x = x  # index of grid
-            self.y = y  # index of grid
-            self.cost = cost
-            self.parent_index = parent_index
-
-        def __str__(self):
-            return str(self.x) + "," + str(self.y) + "," + str(
-                self.cost) + "," + str(self.parent_index)
-
     def planning(self, sx, sy, gx, gy):
         """
         A star path search
@@ -68,89 +82,189 @@ class AStarPlanner:
             ry: y position list of the final path
         """
 
-        start_node = self.Node(self.calc_xy_index(sx, self.min_x),
-                               self.calc_xy_index(sy, self.min_y), 0.0, -1)
-        goal_node = self.Node(self.calc_xy_index(gx, self.min_x),
-                              self.calc_xy_index(gy, self.min_y), 0.0, -1)
-
-        open_set, closed_set = dict(), dict()
-        open_set[self.calc_grid_index(start_node)] = start_node
-
-        while True:
-            if len(open_set) == 0:
-                print("Open set is empty..")
-                break
-
-            c_id = min(
-                open_set,
-                key=lambda o: open_set[o].cost + self.calc_heuristic(goal_node, open_set[o]))
-            current = open_set[c_id]
+        start_x = self.calc_xy_index(sx, self.min_x)
+        start_y = self.calc_xy_index(sy, self.min_y)
+        goal_x = self.calc_xy_index(gx, self.min_x)
+        goal_y = self.calc_xy_index(gy, self.min_y)
+        goal_id = self.calc_grid_index(goal_x, goal_y)
+        if not self.is_inside(goal_x, goal_y):
+            # never reached, as no cell off the grid is searched
+            print("Goal is outside the map..")
+            return [self.calc_grid_position(goal_x, self.min_x)], [
+                self.calc_grid_position(goal_y, self.min_y)]
+
+        cache_key = (self.grid_version, start_x, start_y, goal_id)
+        if cache_key in self.path_cache:
+            self.path_cache.move_to_end(cache_key)
+            rx, ry = self.path_cache[cache_key]
+            return list(rx), list(ry)
+
+        # search state of every cell, indexed by grid index
+        n_cells = self.x_width * self.y_width
+        g_cost = np.full(n_cells, np.inf)
+        f_cost = np.full(n_cells, np.inf)
+        parent = np.full(n_cells, -1, dtype=np.int32)
+        closed = np.zeros(n_cells, dtype=bool)
+        # order in which cells were discovered, -1 if not yet discovered.
+        # It breaks f cost ties the same way as a first-come scan would.
+        order = np.full(n_cells, -1, dtype=np.int32)
+        occupied = self.obstacle_map.ravel()
+        x_limit, y_limit = self.calc_index_limit()
+
+        # priority queue of (f cost, discovery order, grid index). Stale
+        # entries are skipped when popped (lazy deletion).
+        start_inside = self.is_inside(start_x, start_y)
+        n_discovered, n_closed = 1, 0
+        if start_inside:
+            s_id = self.calc_grid_index(start_x, start_y)
+            g_cost[s_id] = 0.0
+            f_cost[s_id] = self.calc_heuristic(
+                goal_x, goal_y, start_x, start_y)
+            order[s_id] = 0
+            open_heap = [(f_cost[s_id], 0, s_id)]
+        else:
+            # a start off the grid (e.g. within resolution / 2 of max_x) is
+            # expanded without being indexed: its free neighbours on the
+            # grid are the first frontier
+            open_heap = []
+            for dx, dy, move_cost in self.motion:
+                n_x, n_y = start_x + dx, start_y + dy
+                if not (0 <= n_x < x_limit and 0 <= n_y < y_limit):
+                    continue
+                n_id = n_x * self.y_width + n_y
+                if occupied[n_id]:
+                    continue
+                order[n_id] = n_discovered
+                n_discovered += 1
+                g_cost[n_id] = move_cost
+                f_cost[n_id] = move_cost + self.calc_heuristic(
+                    goal_x, goal_y, n_x, n_y)
+                heapq.heappush(open_heap, (f_cost[n_id], order[n_id], n_id))
+
+        found = False
+        while open_heap:
+            f, _, c_id = heapq.heappop(open_heap)
+            if closed[c_id] or f > f_cost[c_id]:
+                continue
+            c_x, c_y = divmod(c_id, self.y_width)
 
             # show graph
             if show_animation:  # pragma: no cover
-                plt.plot(self.calc_grid_position(current.x, self.min_x),
-                         self.calc_grid_position(current.y, self.min_y), "xc")
+                plt.plot(self.calc_grid_position(c_x, self.min_x),
+                         self.calc_grid_position(c_y, self.min_y), "xc")
                 # for stopping simulation with the esc key.
                 plt.gcf().canvas.mpl_connect('key_release_event',
                                              lambda event: [exit(
                                                  0) if event.key == 'escape' else None])
-                if len(closed_set.keys()) % 10 == 0:
+                if n_closed % 10 == 0:
                     plt.pause(0.001)
 
-            if current.x == goal_node.x and current.y == goal_node.y:
+            if c_id == goal_id:
                 print("Find goal")
-                goal_node.parent_index = current.parent_index
-                goal_node.cost = current.cost
+                found = True
                 break
 
-            # Remove the item from the open set
-            del open_set[c_id]
-
             # Add it to the closed set
-            closed_set[c_id] = current
+            closed[c_id] = True
+            n_closed += 1
 
             # expand_grid search grid based on motion model
-            for i, _ in enumerate(self.motion):
-                node = self.Node(current.x + self.motion[i][0],
-                                 current.y + self.motion[i][1],
-                                 current.cost + self.motion[i][2], c_id)
-                n_id = self.calc_grid_index(node)
+            c_cost = g_cost[c_id]
+            for dx, dy, move_cost in self.motion:
+                n_x, n_y = c_x + dx, c_y + dy
 
                 # If the node is not safe, do nothing
-                if not self.verify_node(node):
+                if not (0 <= n_x < x_limit and 0 <= n_y < y_limit):
                     continue
-
-                if n_id in closed_set:
+                n_id = n_x * self.y_width + n_y
+                if occupied[n_id] or closed[n_id]:
                     continue
 
-                if n_id not in open_set:
-                    open_set[n_id] = node  # discovered a new node
-                else:
-                    if open_set[n_id].cost > node.cost:
-                        # This path is the best until now. record it
-                        open_set[n_id] = node
+                cost = c_cost + move_cost
+                if order[n_id] < 0:
+                    order[n_id] = n_discovered  # discovered a new node
+                    n_discovered += 1
+                elif g_cost[n_id] <= cost:
+                    continue
 
-        rx, ry = self.calc_final_path(goal_node, closed_set)
+                # This path is the best until now. record it
+                g_cost[n_id] = cost
+                parent[n_id] = c_id
+                f_cost[n_id] = cost + self.calc_heuristic(
+                    goal_x, goal_y, n_x, n_y)
+                heapq.heappush(open_heap, (f_cost[n_id], order[n_id], n_id))
+        else:
+            print("Open set is empty..")
+
+        rx, ry = self.calc_final_path(
+            goal_id, parent if found else None)
+        if found and not start_inside:
+            rx.append(self.calc_grid_position(start_x, self.min_x))
+            ry.append(self.calc_grid_position(start_y, self.min_y))
+
+        if self.path_cache_size > 0:
+            self.path_cache[cache_key] = (tuple(rx), tuple(ry))
+            if len(self.path_cache) > self.path_cache_size:
+                self.path_cache.popitem(last=False)
 
         return rx, ry
 
-    def calc_final_path(self, goal_node, closed_set):
+    def plan_many(self, queries, n_workers=None):
+        """
+        Plan many start/goal pairs on this grid over a process pool
+
+        The obstacle map is built once and shared read-only with the
+        workers through shared memory. Prints and animation are turned off
+        while planning.
+
+        input:
+            queries: [(sx, sy, gx, gy), ...] positions [m]
+            n_workers: number of worker processes, os.cpu_count() if None
+
+        output:
+            results: [(rx, ry, elapsed time [s]), ...] in the order of
+                queries
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        n_workers = min(n_workers, len(queries))
+        if n_workers <= 1:
+            return [_plan_quietly(self, query) for query in queries]
+
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in ("ob", "obstacle_count", "obstacle_map",
+                                "path_cache", "distance_field")}
+
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(self.obstacle_map.nbytes, 1))
+        try:
+            np.ndarray(self.obstacle_map.shape, dtype=bool,
+                       buffer=shm.buf)[:] = self.obstacle_map
+            with multiprocessing.Pool(
+                    n_workers, initializer=_init_plan_worker,
+                    initargs=(type(self), state, shm.name,
+                              self.obstacle_map.shape)) as pool:
+                return pool.map(_plan_worker, queries)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def calc_final_path(self, goal_id, parent):
         # generate final course
-        rx, ry = [self.calc_grid_position(goal_node.x, self.min_x)], [
-            self.calc_grid_position(goal_node.y, self.min_y)]
-        parent_index = goal_node.parent_index
-        while parent_index != -1:
-            n = closed_set[parent_index]
-            rx.append(self.calc_grid_position(n.x, self.min_x))
-            ry.append(self.calc_grid_position(n.y, self.min_y))
-            parent_index = n.parent_index
+        rx, ry = [], []
+        index = goal_id
+        while index != -1:
+            ix, iy = divmod(index, self.y_width)
+            rx.append(self.calc_grid_position(ix, self.min_x))
+            ry.append(self.calc_grid_position(iy, self.min_y))
+            index = -1 if parent is None else parent[index]
 
         return rx, ry
 
     @staticmethod
-    def calc_heuristic(n1, n2):
+    def calc_heuristic(x1, y1, x2, y2):
         w = 1.0  # weight of heuristic
-        d = w * math.hypot(n1.x - n2.x, n1.y - n2.y)
+        d = w * math.hypot(x1 - x2, y1 - y2)
         return d
 
     def calc_grid_position(self, index, min_position):
@@ -167,24 +281,28 @@ class AStarPlanner:
     def calc_xy_index(self, position, min_pos):
         return round((position - min_pos) / self.resolution)
 
-    def calc_grid_index(self, node):
-        return (node.y - self.min_y) * self.x_width + (node.x - self.min_x)
+    def calc_grid_index(self, ix, iy):
+        return ix * self.y_width + iy
 
-    def verify_node(self, node):
-        px = self.calc_grid_position(node.x, self.min_x)
-        py = self.calc_grid_position(node.y, self.min_y)
+    def calc_index_limit(self):
+        """
+        Number of grid indices along x and y whose position is inside
+        [min, max) and that are covered by the obstacle map
+        """
+        x_limit = math.ceil((self.max_x - self.min_x) / self.resolution)
+        y_limit = math.ceil((self.max_y - self.min_y) / self.resolution)
+        return min(x_limit, self.x_width), min(y_limit, self.y_width)
 
-        if px < self.min_x:
-            return False
-        elif py < self.min_y:
-            return False
-        elif px >= self.max_x:
-            return False
-        elif py >= self.max_y:
+    def is_inside(self, ix, iy):
+        x_limit, y_limit = self.calc_index_limit()
+        return 0 <= ix < x_limit and 0 <= iy < y_limit
+
+    def verify_node(self, ix, iy):
+        if not self.is_inside(ix, iy):
             return False
 
         # collision check
-        if self.obstacle_map[node.x][node.y]:
+        if self.obstacle_map[ix, iy]:
             return False
 
         return True
@@ -211,17 +329,90 @@ class AStarPlanner:
         print("y_width:", self.y_width)
 
         # obstacle map generation
-        self.obstacle_map = [[False for _ in range(self.y_width)]
-                             for _ in range(self.x_width)]
-        for ix in range(self.x_width):
-            x = self.calc_grid_position(ix, self.min_x)
-            for iy in range(self.y_width):
-                y = self.calc_grid_position(iy, self.min_y)
-                for iox, ioy in self.ob:
-                    d = math.hypot(iox - x, ioy - y)
-                    if d <= self.rr:
-                        self.obstacle_map[ix][iy] = True
-                        break
+        # obstacle_count holds the number of obstacles within rr of each
+        # cell, so that obstacles can be added and removed incrementally.
+        # The counts of all cells come from one KD-tree query.
+        x = self.calc_grid_position(np.arange(self.x_width), self.min_x)
+        y = self.calc_grid_position(np.arange(self.y_width), self.min_y)
+        cells = np.stack(np.meshgrid(x, y, indexing="ij"), axis=-1)
+        if self.distance_field is not None:
+            # with a distance field the counts are only 0 or 1, which is
+            # enough to add obstacles but not to remove them
+            occupied = self.distance_field.calc_distance(
+                cells[..., 0], cells[..., 1]) <= self.rr
+            self.obstacle_count = occupied.astype(np.int32)
+        else:
+            count = cKDTree(self.ob).query_ball_point(
+                cells.reshape(-1, 2), r=self.rr, return_length=True)
+            self.obstacle_count = count.astype(np.int32).reshape(
+                self.x_width, self.y_width)
+        self.obstacle_map = self.obstacle_count > 0
+        self.grid_version += 1
+        self.path_cache.clear()
+
+    def calc_covered_cells(self, points):
+        """
+        Grid indices of the cells within rr of each point
+
+        :param points: [[x(m), y(m)], ...]
+        :return: grid indices, repeated once per covering point
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        n = math.ceil(self.rr / self.resolution) + 1
+        offsets = np.arange(-n, n + 1)
+        ix = np.round((points[:, 0] - self.min_x) / self.resolution)
+        iy = np.round((points[:, 1] - self.min_y) / self.resolution)
+        ix = ix.astype(int)[:, None, None] + offsets[None, :, None]
+        iy = iy.astype(int)[:, None, None] + offsets[None, None, :]
+        dx = self.calc_grid_position(ix, self.min_x) - points[:, 0, None, None]
+        dy = self.calc_grid_position(iy, self.min_y) - points[:, 1, None, None]
+        ix, iy = np.broadcast_arrays(ix, iy)
+        covered = ((dx * dx + dy * dy <= self.rr * self.rr)
+                   & (0 <= ix) & (ix < self.x_width)
+                   & (0 <= iy) & (iy < self.y_width))
+        return self.calc_grid_index(ix[covered], iy[covered])
+
+    def add_obstacles(self, points):
+        """
+        Add obstacles to the map, updating only the cells within rr of them
+
+        points: [[x(m), y(m)], ...]
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.ob = np.vstack((self.ob, points))
+        if self.distance_field is not None:
+            self.distance_field.add_obstacles(points)
+        self.update_obstacle_count(self.calc_covered_cells(points), 1)
+
+    def remove_obstacles(self, points):
+        """
+        Remove obstacles from the map, updating only the cells within rr
+        of them. Each point must match an obstacle position exactly.
+
+        points: [[x(m), y(m)], ...]
+        """
+        if self.distance_field is not None:
+            raise ValueError("obstacles cannot be removed from a planner "
+                             "built on a distance field")
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        keep = np.ones(len(self.ob), dtype=bool)
+        for point in points:
+            match = np.flatnonzero(keep & np.all(self.ob == point, axis=1))
+            if len(match) == 0:
+                raise ValueError(
+                    "obstacle ({}, {}) is not on the map".format(*point))
+            keep[match[0]] = False
+        self.ob = self.ob[keep]
+        self.update_obstacle_count(self.calc_covered_cells(points), -1)
+
+    def update_obstacle_count(self, indices, delta):
+        count = self.obstacle_count.reshape(-1)
+        np.add.at(count, indices, delta)
+        occupied = count[indices] > 0
+        if np.any(self.obstacle_map.reshape(-1)[indices] != occupied):
+            self.obstacle_map.reshape(-1)[indices] = occupied
+            self.grid_version += 1
+            self.path_cache.clear()
 
     @staticmethod
     def get_motion_model():
@@ -238,6 +429,52 @@ class AStarPlanner:
         return motion
 
 
+# planner of the current plan_many worker process
+_worker_planner = None
+_worker_shm = None
+
+
+def _init_plan_worker(cls, state, shm_name, shape):
+    """
+    Rebuild a planner from its state in a plan_many worker process, with
+    the obstacle map of the given shape held in the shared memory block
+    shm_name
+    """
+    global _worker_planner, _worker_shm
+    planner = cls.__new__(cls)
+    planner.__dict__.update(state)
+    planner.path_cache = OrderedDict()
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    planner.obstacle_map = np.ndarray(shape, dtype=bool,
+                                      buffer=_worker_shm.buf)
+    _worker_planner = planner
+
+
+def _plan_worker(query):
+    return _plan_quietly(_worker_planner, query)
+
+
+def _plan_quietly(planner, query):
+    """
+    planner.planning(*query) with prints and animation turned off
+
+    output:
+        rx, ry, elapsed time [s]
+    """
+    global show_animation
+    module = sys.modules[type(planner).__module__]
+    animation = show_animation, getattr(module, "show_animation", False)
+    show_animation = module.show_animation = False
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            rx, ry = planner.planning(*query)
+            elapsed = time.perf_counter() - start
+    finally:
+        show_animation, module.show_animation = animation
+    return rx, ry, elapsed
+
+
 def main():
     print(__file__ + " start!!")
 
@@ -0,0 +1,281 @@
+"""
+
+D* Lite grid planning
+
+Incremental version of the A* grid planner. The search runs backwards from
+the goal, and its g/rhs values are kept between calls to planning(), so a
+replan after obstacles are added/removed or after the robot moves only
+repairs the part of the search tree that is affected.
+
+See S. Koenig and M. Likhachev, "D* Lite", AAAI 2002.
+
+"""
+
+import heapq
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from a_star import AStarPlanner
+
+show_animation = True
+
+
+class DStarLitePlanner(AStarPlanner):
+
+    def __init__(
+        self, ob, resolution, rr,
+        min_x=None, min_y=None, max_x=None, max_y=None
+    ):
+        """
+        Initialize grid map for d star lite planning
+
+        ob: obstacle positions [[x(m), y(m)], ...]
+        resolution: grid resolution [m]
+        rr: robot radius[m]
+        """
+        super().__init__(ob, resolution, rr,
+                         min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y)
+        self.goal_id = None
+        self.start_id = None
+        self.last_id = None
+        self.km = 0.0
+        self.g = None
+        self.rhs = None
+        self.key = None
+        self.in_queue = None
+        self.queue = []
+        self.changed_cells = set()
+        self.n_expanded = 0
+        self.x_limit, self.y_limit = self.calc_index_limit()
+
+    def planning(self, sx, sy, gx, gy):
+        """
+        D* lite path search
+
+        The search tree is reused as long as the goal stays the same.
+
+        input:
+            s_x: start x position [m]
+            s_y: start y position [m]
+            gx: goal x position [m]
+            gy: goal y position [m]
+
+        output:
+            rx: x position list of the final path
+            ry: y position list of the final path
+        """
+        start_x = self.calc_xy_index(sx, self.min_x)
+        start_y = self.calc_xy_index(sy, self.min_y)
+        goal_x = self.calc_xy_index(gx, self.min_x)
+        goal_y = self.calc_xy_index(gy, self.min_y)
+        if not self.is_inside(goal_x, goal_y):
+            print("Goal is outside the map..")
+            return [self.calc_grid_position(goal_x, self.min_x)], [
+                self.calc_grid_position(goal_y, self.min_y)]
+        if not self.is_inside(start_x, start_y):
+            # the A* search expands a start off the grid without indexing it
+            print("Start is outside the map, falling back to A*..")
+            return super().planning(sx, sy, gx, gy)
+        start_id = self.calc_grid_index(start_x, start_y)
+        goal_id = self.calc_grid_index(goal_x, goal_y)
+
+        self.n_expanded = 0
+        if goal_id != self.goal_id:
+            self.initialize(start_id, goal_id)
+        else:
+            # the robot moved: keep the old keys valid by raising km
+            self.start_id = start_id
+            self.km += self.calc_heuristic_id(self.last_id, start_id)
+            self.last_id = start_id
+            for c_id in self.changed_cells:
+                for n_id, _ in self.get_neighbours(c_id):
+                    self.update_vertex(n_id)
+        self.changed_cells = set()
+
+        self.compute_shortest_path()
+
+        if self.g[start_id] == np.inf:
+            print("Open set is empty..")
+            return self.calc_final_path(goal_id, None)
+        print("Find goal")
+
+        return self.extract_path()
+
+    def initialize(self, start_id, goal_id):
+        n_cells = self.x_width * self.y_width
+        self.start_id = self.last_id = start_id
+        self.goal_id = goal_id
+        self.km = 0.0
+        self.g = np.full(n_cells, np.inf)
+        self.rhs = np.full(n_cells, np.inf)
+        self.key = np.full((n_cells, 2), np.inf)
+        self.in_queue = np.zeros(n_cells, dtype=bool)
+        self.queue = []
+        self.rhs[goal_id] = 0.0
+        self.push(goal_id)
+
+    def calc_key(self, c_id):
+        k2 = min(self.g[c_id], self.rhs[c_id])
+        k1 = k2 + self.calc_heuristic_id(self.start_id, c_id) + self.km
+        # rounded so that keys which differ only by floating point error
+        # compare equal and fall through to the k2 tie break
+        return round(float(k1), 9), round(float(k2), 9)
+
+    def push(self, c_id):
+        key = self.calc_key(c_id)
+        self.key[c_id] = key
+        self.in_queue[c_id] = True
+        heapq.heappush(self.queue, (key[0], key[1], c_id))
+
+    def top_key(self):
+        # drop entries that were removed or re-keyed since they were pushed
+        while self.queue:
+            k1, k2, c_id = self.queue[0]
+            if self.in_queue[c_id] and (k1, k2) == tuple(self.key[c_id]):
+                return k1, k2
+            heapq.heappop(self.queue)
+        return np.inf, np.inf
+
+    def update_vertex(self, c_id):
+        if c_id != self.goal_id:
+            rhs = np.inf
+            for n_id, cost in self.get_neighbours(c_id):
+                if not self.obstacle_map.flat[n_id]:
+                    rhs = min(rhs, cost + self.g[n_id])
+            self.rhs[c_id] = rhs
+        self.in_queue[c_id] = False
+        if self.g[c_id] != self.rhs[c_id]:
+            self.push(c_id)
+
+    def compute_shortest_path(self):
+        start_id = self.start_id
+        while (self.top_key() < self.calc_key(start_id)
+               or self.rhs[start_id] != self.g[start_id]):
+            k_old = self.top_key()
+            if k_old == (np.inf, np.inf):
+                break
+            c_id = heapq.heappop(self.queue)[2]
+            k_new = self.calc_key(c_id)
+            if k_old < k_new:
+                self.push(c_id)
+                continue
+
+            self.in_queue[c_id] = False
+            self.n_expanded += 1
+            if show_animation:  # pragma: no cover
+                c_x, c_y = divmod(c_id, self.y_width)
+                plt.plot(self.calc_grid_position(c_x, self.min_x),
+                         self.calc_grid_position(c_y, self.min_y), "xc")
+                if self.n_expanded % 10 == 0:
+                    plt.pause(0.001)
+
+            if self.g[c_id] > self.rhs[c_id]:
+                self.g[c_id] = self.rhs[c_id]
+                affected = []
+            else:
+                self.g[c_id] = np.inf
+                affected = [c_id]
+            # only cells that can move into c_id depend on its g value
+            if not self.obstacle_map.flat[c_id]:
+                affected += [n_id for n_id, _ in self.get_neighbours(c_id)]
+            for n_id in affected:
+                self.update_vertex(n_id)
+
+    def extract_path(self):
+        # follow the cheapest successor from start to goal
+        path = [self.start_id]
+        c_id = self.start_id
+        while c_id != self.goal_id and len(path) <= len(self.g):
+            best_id, best_cost = None, np.inf
+            for n_id, cost in self.get_neighbours(c_id):
+                if self.obstacle_map.flat[n_id]:
+                    continue
+                if cost + self.g[n_id] < best_cost:
+                    best_id, best_cost = n_id, cost + self.g[n_id]
+            if best_id is None:
+                break
+            c_id = best_id
+            path.append(c_id)
+
+        # goal first, like AStarPlanner.planning
+        rx, ry = [], []
+        for c_id in reversed(path):
+            ix, iy = divmod(c_id, self.y_width)
+            rx.append(self.calc_grid_position(ix, self.min_x))
+            ry.append(self.calc_grid_position(iy, self.min_y))
+
+        return rx, ry
+
+    def get_neighbours(self, c_id):
+        c_x, c_y = divmod(c_id, self.y_width)
+        for dx, dy, cost in self.motion:
+            n_x, n_y = c_x + dx, c_y + dy
+            if 0 <= n_x < self.x_limit and 0 <= n_y < self.y_limit:
+                yield n_x * self.y_width + n_y, cost
+
+    def calc_heuristic_id(self, id1, id2):
+        x1, y1 = divmod(id1, self.y_width)
+        x2, y2 = divmod(id2, self.y_width)
+        return self.calc_heuristic(x1, y1, x2, y2)
+
+    def update_obstacle_count(self, indices, delta):
+        before = self.obstacle_map.reshape(-1)[indices]
+        super().update_obstacle_count(indices, delta)
+        after = self.obstacle_map.reshape(-1)[indices]
+        # cells whose occupancy flipped, repaired at the next planning call
+        self.changed_cells.update(np.unique(indices[before != after]).tolist())
+
+
+def main():
+    print(__file__ + " start!!")
+
+    # start and goal position
+    sx = 10.0  # [m]
+    sy = 10.0  # [m]
+    gx = 50.0  # [m]
+    gy = 50.0  # [m]
+    grid_size = 2.0  # [m]
+    robot_radius = 1.0  # [m]
+
+    ox, oy = [], []
+    for i in range(-10, 40):
+        ox.append(20.0)
+        oy.append(i)
+    for i in range(0, 40):
+        ox.append(40.0)
+        oy.append(60.0 - i)
+    ob = np.array([ox, oy]).transpose()
+
+    if show_animation:  # pragma: no cover
+        plt.plot(ox, oy, ".k")
+        plt.plot(sx, sy, "og")
+        plt.plot(gx, gy, "xb")
+        plt.grid(True)
+        plt.axis("equal")
+
+    d_star_lite = DStarLitePlanner(
+        ob, grid_size, robot_radius,
+        min_x=min(*ox, sx-2, gx-2), min_y=min(*oy, sy-2, gy-2),
+        max_x=max(*ox, sx+2, gx+2), max_y=max(*oy, sy+2, gy+2)
+    )
+    rx, ry = d_star_lite.planning(sx, sy, gx, gy)
+    print("expanded:", d_star_lite.n_expanded)
+
+    # block the planned path half way and replan from a later position
+    new_ob = np.array([[x, y] for x, y in zip(rx, ry)][len(rx) // 3:][:3])
+    d_star_lite.add_obstacles(new_ob)
+    sx, sy = rx[-3], ry[-3]
+    rx2, ry2 = d_star_lite.planning(sx, sy, gx, gy)
+    print("expanded after replanning:", d_star_lite.n_expanded)
+
+    if show_animation:  # pragma: no cover
+        plt.plot(rx, ry, "-r")
+        plt.plot(new_ob[:, 0], new_ob[:, 1], "ok")
+        plt.plot(rx2, ry2, "-b")
+        plt.pause(0.001)
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,16 @@ In this version of codes,
 
 import os
 import math
+import multiprocessing
+import time
+import weakref
+from collections import OrderedDict
 from enum import Enum
+from multiprocessing import shared_memory
 
 import matplotlib.pyplot as plt
 import numpy as np
+from scipy.spatial import cKDTree
 
 show_animation = True
 save_animation_to_figs = False
@@ -25,7 +31,8 @@ if save_costs_fig:
     to_goal_cost_list, speed_cost_list, ob_cost_list = [], [], []
 
 
-def dwa_control(x, config, goal, ob):
+def dwa_control(x, config, goal, ob, ob_index=None, primitives=None,
+                contact_cache=None, pool=None, coverage=None):
     """
     Dynamic Window Approach control
     Parameters:
@@ -36,19 +43,591 @@ def dwa_control(x, config, goal, ob):
             [x(m), y(m)]
         ob: obstacle positions
             [[x(m), y(m)], ...]
+        ob_index: ObstacleIndex of ob, optional. Build it once per obstacle
+            set so that collision checks only look at nearby obstacles.
+        primitives: MotionPrimitives of config, optional. The window is
+            then sampled on its lattice. Needed by the "swept" collision
+            check.
+        contact_cache: ContactCache kept from one call to the next,
+            optional. Used with ob_index to speed up the closed-form check.
+        pool: ObstacleSearchPool of ob and config, optional. Obstacles are
+            then searched for the samples in its worker processes.
+        coverage: WindowCoverage, optional, updated with how much of the
+            window this call covered
     Returns:
         u: control input
             [v(m/s), omega(rad/s)]
         trajectory: predicted trajectory with selected input
             [[x(m), y(m), yaw(rad), v(m/s), omega(rad/s)], ...]
     """
+    start = time.perf_counter()
     dw = calc_dynamic_window(x, config)
 
-    u, trajectory = calc_control_and_trajectory(x, dw, config, goal, ob)
+    if config.control_time_budget > 0:
+        deadline = start + config.control_time_budget
+    else:
+        deadline = None
+    u, trajectory = calc_control_and_trajectory(x, dw, config, goal, ob,
+                                                ob_index, primitives,
+                                                contact_cache, pool,
+                                                deadline, coverage)
 
     return u, trajectory
 
 
+class ObstacleIndex:
+    """
+    KD-tree over an obstacle set, to look up the obstacles near given points
+    """
+
+    def __init__(self, ob):
+        """
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        """
+        self.ob = np.asarray(ob, dtype=float).reshape(-1, 2)
+        self.tree = cKDTree(self.ob)
+
+    def query_nearest(self, points, max_dist):
+        """
+        squared distance from each point to its nearest obstacle, inf if it
+        is farther than max_dist
+        """
+        # the bound is widened a little so that distances equal to
+        # max_dist are not cut off by rounding
+        _, i = self.tree.query(
+            points, distance_upper_bound=max_dist * (1 + 1e-9) + 1e-12)
+        found = i < len(self.ob)
+        d2 = np.full(len(points), np.inf)
+        # recomputed the same way as without the index, to get the same
+        # floats
+        d2[found] = ((points[found, 0] - self.ob[i[found], 0]) ** 2
+                     + (points[found, 1] - self.ob[i[found], 1]) ** 2)
+        return d2
+
+    def query_pairs(self, points, max_dist):
+        """
+        indices (point, obstacle) of the obstacles within max_dist of each
+        point
+        """
+        near = self.tree.query_ball_point(
+            points, max_dist * (1 + 1e-9) + 1e-12)
+        counts = np.fromiter((len(i) for i in near), dtype=int, count=len(near))
+        if counts.sum() == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        return (np.repeat(np.arange(len(near)), counts),
+                np.concatenate([i for i in near if i]).astype(int))
+
+    def query_ball(self, point, max_dist):
+        """
+        obstacles within max_dist of a point
+        """
+        return self.ob[self.tree.query_ball_point(
+            point, max_dist * (1 + 1e-9) + 1e-12)]
+
+    def add_obstacles(self, points):
+        """
+        points: [[x(m), y(m)], ...]
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.ob = np.vstack((self.ob, points))
+        self.tree = cKDTree(self.ob)
+
+    def calc_distance(self, x, y):
+        """
+        distance to the nearest obstacle
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        dist, _ = self.tree.query(np.stack((x, y), axis=-1))
+        return dist
+
+    def calc_hits(self, px, py, yaw, footprint):
+        """
+        whether the robot collides with an obstacle at each pose, always
+        from exact distances
+        """
+        half_length, half_width, radius = footprint
+        points = np.stack((px, py), axis=1)
+        if half_length == 0 and half_width == 0:
+            d2 = ObstacleIndex.query_nearest(self, points, radius)
+        else:
+            pose, near = ObstacleIndex.query_pairs(
+                self, points, math.hypot(half_length, half_width) + radius)
+            d2 = np.full(len(points), np.inf)
+            np.minimum.at(d2, pose, calc_box_distance2(
+                self.ob[near], px[pose], py[pose], yaw[pose],
+                half_length, half_width))
+        return np.sqrt(d2) <= radius
+
+
+class DistanceField(ObstacleIndex):
+    """
+    ObstacleIndex that also samples the distance to the nearest obstacle on
+    a grid, capped at max_distance. Clearances are then read by bilinear
+    interpolation in O(1) per point, whatever the number of obstacles.
+    The interpolated clearance is exact on the grid nodes and within
+    resolution / sqrt(2) of the true one elsewhere.
+    """
+
+    def __init__(self, ob, resolution, max_distance,
+                 min_x=None, min_y=None, max_x=None, max_y=None):
+        """
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        resolution: grid resolution [m]
+        max_distance: distances are capped at this value [m]
+        min_x, min_y, max_x, max_y: grid bounds [m], default to the
+            obstacles' bounds widened by max_distance. The grid nodes are
+            at min_x + i * resolution, min_y + j * resolution.
+        """
+        super().__init__(ob)
+        self.resolution = resolution
+        self.max_distance = max_distance
+        self.max_error = resolution / math.sqrt(2)
+        if min_x is None:
+            min_x = math.floor((self.ob[:, 0].min() - max_distance)
+                               / resolution) * resolution
+        if min_y is None:
+            min_y = math.floor((self.ob[:, 1].min() - max_distance)
+                               / resolution) * resolution
+        if max_x is None:
+            max_x = self.ob[:, 0].max() + max_distance
+        if max_y is None:
+            max_y = self.ob[:, 1].max() + max_distance
+        self.min_x, self.min_y = min_x, min_y
+        self.x_width = math.ceil((max_x - min_x) / resolution) + 1
+        self.y_width = math.ceil((max_y - min_y) / resolution) + 1
+        self.distance = np.full((self.x_width, self.y_width), max_distance)
+        self.update_distance(self.ob)
+
+    def update_distance(self, points):
+        # only nodes within max_distance of the points can get closer
+        if len(points) == 0:
+            return
+        n = math.ceil(self.max_distance / self.resolution)
+        ix = np.floor((points[:, 0] - self.min_x) / self.resolution)
+        iy = np.floor((points[:, 1] - self.min_y) / self.resolution)
+        x0, x1 = max(int(ix.min()) - n, 0), min(int(ix.max()) + n + 2,
+                                                self.x_width)
+        y0, y1 = max(int(iy.min()) - n, 0), min(int(iy.max()) + n + 2,
+                                                self.y_width)
+        if x0 >= x1 or y0 >= y1:
+            return
+        nx, ny = np.meshgrid(self.min_x + np.arange(x0, x1) * self.resolution,
+                             self.min_y + np.arange(y0, y1) * self.resolution,
+                             indexing="ij")
+        dist, _ = cKDTree(points).query(
+            np.stack((nx.ravel(), ny.ravel()), axis=1),
+            distance_upper_bound=self.max_distance)
+        window = self.distance[x0:x1, y0:y1]
+        np.minimum(window, dist.reshape(window.shape), out=window)
+
+    def add_obstacles(self, points):
+        """
+        Add obstacles, updating only the grid nodes near them
+
+        points: [[x(m), y(m)], ...]
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        super().add_obstacles(points)
+        self.update_distance(points)
+
+    def calc_distance(self, x, y):
+        """
+        distance to the nearest obstacle, capped at max_distance, by
+        bilinear interpolation of the grid. Points off the grid are looked
+        up in the KD-tree instead.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                                   np.asarray(y, dtype=float))
+        gx = (x - self.min_x) / self.resolution
+        gy = (y - self.min_y) / self.resolution
+        inside = ((0 <= gx) & (gx <= self.x_width - 1)
+                  & (0 <= gy) & (gy <= self.y_width - 1))
+        ix = np.clip(np.floor(gx), 0, self.x_width - 2).astype(int)
+        iy = np.clip(np.floor(gy), 0, self.y_width - 2).astype(int)
+        u, w = np.clip(gx - ix, 0, 1), np.clip(gy - iy, 0, 1)
+        d = self.distance
+        dist = ((1 - u) * ((1 - w) * d[ix, iy] + w * d[ix, iy + 1])
+                + u * ((1 - w) * d[ix + 1, iy] + w * d[ix + 1, iy + 1]))
+        if not np.all(inside):
+            far, _ = self.tree.query(
+                np.stack((x[~inside], y[~inside]), axis=-1),
+                distance_upper_bound=self.max_distance)
+            dist[~inside] = np.minimum(far, self.max_distance)
+        return dist
+
+    def query_nearest(self, points, max_dist):
+        """
+        squared clearance of each point from the distance field, inf if it
+        is farther than max_dist
+        """
+        if max_dist >= self.max_distance:
+            return super().query_nearest(points, max_dist)
+        d = self.calc_distance(points[:, 0], points[:, 1])
+        return np.where(d <= max_dist, d ** 2, np.inf)
+
+
+class ConfigurationSpace(ObstacleIndex):
+    """
+    ObstacleIndex that also stores, for n_yaw_bins headings of a box
+    footprint, the grid cells where the robot centre may collide: the
+    obstacle map dilated by the footprint rotated to the heading. Whether
+    a pose collides is then one lookup in the bitmap of its heading. The
+    bitmaps are conservative, and only the poses they flag are checked
+    exactly, so the hits are the same as those of ObstacleIndex.
+    """
+
+    # bitmaps built so far, by obstacle set, footprint, resolution and
+    # number of yaw bins
+    cache = OrderedDict()
+    cache_size = 8
+
+    def __init__(self, ob, footprint, resolution, n_yaw_bins):
+        """
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        footprint: (half_length(m), half_width(m), radius(m))
+        resolution: grid resolution [m]
+        n_yaw_bins: number of headings over [0, pi), the footprint being
+            symmetric under a half turn
+        """
+        super().__init__(ob)
+        self.footprint = tuple(footprint)
+        self.resolution = resolution
+        self.n_yaw_bins = n_yaw_bins
+        half_length, half_width, radius = footprint
+        # a pose and an obstacle are each within resolution / sqrt(2) of
+        # their cell centres
+        margin = radius + resolution * math.sqrt(2)
+        n = math.ceil((math.hypot(half_length, half_width) + margin)
+                      / resolution)
+        bounds = self.ob if len(self.ob) > 0 else np.zeros((1, 2))
+        lo = np.floor(bounds.min(axis=0) / resolution) - n
+        hi = np.ceil(bounds.max(axis=0) / resolution) + n
+        self.min_x, self.min_y = lo * resolution
+        self.x_width, self.y_width = (int(w) for w in hi - lo + 1)
+
+        # cell offsets from the robot centre to an obstacle that may
+        # collide, per yaw bin; a heading within half a bin of the bin
+        # centre moves an offset d by at most |d| * bin / 2
+        dx, dy = np.meshgrid(np.arange(-n, n + 1) * resolution,
+                             np.arange(-n, n + 1) * resolution, indexing="ij")
+        yaw = np.arange(n_yaw_bins) * math.pi / n_yaw_bins
+        d2 = calc_box_distance2(np.stack((dx, dy), axis=-1)[None],
+                                0.0, 0.0, yaw[:, None, None],
+                                half_length, half_width)
+        sweep = np.hypot(dx, dy) * math.pi / (2 * n_yaw_bins)
+        self.structures = np.sqrt(d2) <= margin + sweep
+
+        self.occupied = np.zeros((n_yaw_bins, self.x_width, self.y_width),
+                                 dtype=bool)
+        self.update_occupied(self.ob)
+
+    @classmethod
+    def cached(cls, ob, footprint, resolution, n_yaw_bins):
+        """
+        ConfigurationSpace of ob, reused if it was built before with the
+        same footprint, resolution and number of yaw bins. The instance is
+        shared, so obstacles added to it are seen by every user.
+        """
+        ob = np.asarray(ob, dtype=float).reshape(-1, 2)
+        key = (ob.tobytes(), tuple(footprint), resolution, n_yaw_bins)
+        c_space = cls.cache.get(key)
+        # obstacles added since then make it another map
+        if c_space is None or len(c_space.ob) != len(ob):
+            c_space = cls(ob, footprint, resolution, n_yaw_bins)
+        cls.cache[key] = c_space
+        cls.cache.move_to_end(key)
+        if len(cls.cache) > cls.cache_size:
+            cls.cache.popitem(last=False)
+        return c_space
+
+    def calc_cells(self, px, py):
+        ix = np.rint((px - self.min_x) / self.resolution).astype(int)
+        iy = np.rint((py - self.min_y) / self.resolution).astype(int)
+        inside = ((0 <= ix) & (ix < self.x_width)
+                  & (0 <= iy) & (iy < self.y_width))
+        return ix, iy, inside
+
+    def update_occupied(self, points):
+        # only cells within n of the points can get occupied, from the
+        # points up to n cells around them
+        if len(points) == 0:
+            return
+        n = self.structures.shape[1] // 2
+        ix, iy, _ = self.calc_cells(points[:, 0], points[:, 1])
+        x0, x1 = max(ix.min() - n, 0), min(ix.max() + n + 1, self.x_width)
+        y0, y1 = max(iy.min() - n, 0), min(iy.max() + n + 1, self.y_width)
+        if x0 >= x1 or y0 >= y1:
+            return
+        near = (x0 - n <= ix) & (ix < x1 + n) & (y0 - n <= iy) & (iy < y1 + n)
+        cells = np.unique(np.stack((ix[near], iy[near]), axis=1), axis=0)
+        for k, structure in enumerate(self.structures):
+            # dilation of the obstacle cells by the structure, which is
+            # symmetric: each obstacle cell occupies the robot centres at
+            # the offsets of the structure around it
+            offsets = np.argwhere(structure) - n
+            cx = (cells[:, 0, None] + offsets[:, 0]).ravel()
+            cy = (cells[:, 1, None] + offsets[:, 1]).ravel()
+            inside = (x0 <= cx) & (cx < x1) & (y0 <= cy) & (cy < y1)
+            self.occupied[k, cx[inside], cy[inside]] = True
+
+    def add_obstacles(self, points):
+        """
+        Add obstacles, updating only the grid cells near them
+
+        points: [[x(m), y(m)], ...]
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        super().add_obstacles(points)
+        self.update_occupied(points)
+
+    def calc_hits(self, px, py, yaw, footprint):
+        """
+        whether the robot collides with an obstacle at each pose, from the
+        bitmaps for the footprint they were built for. Poses they flag or
+        that are off the grid are checked exactly.
+        """
+        if tuple(footprint) != self.footprint:
+            return super().calc_hits(px, py, yaw, footprint)
+        ix, iy, inside = self.calc_cells(px, py)
+        k = np.rint(np.mod(yaw, math.pi) * self.n_yaw_bins / math.pi)
+        k = k.astype(int) % self.n_yaw_bins
+        maybe = ~inside
+        maybe[inside] = self.occupied[k[inside], ix[inside], iy[inside]]
+        hit = np.zeros(len(px), dtype=bool)
+        if np.any(maybe):
+            hit[maybe] = super().calc_hits(px[maybe], py[maybe], yaw[maybe],
+                                           footprint)
+        return hit
+
+
+class OccupancyGrid(ObstacleIndex):
+    """
+    ObstacleIndex that also marks, on a grid, the cells that hold an
+    obstacle and their 8 neighbours. A point within resolution of an
+    obstacle along both axes is then always in a marked cell, however the
+    grid of the point was rotated.
+    """
+
+    def __init__(self, ob, resolution):
+        """
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        resolution: grid resolution [m]
+        """
+        super().__init__(ob)
+        self.resolution = resolution
+        bounds = self.ob if len(self.ob) > 0 else np.zeros((1, 2))
+        lo = np.floor(bounds.min(axis=0) / resolution) - 1
+        hi = np.ceil(bounds.max(axis=0) / resolution) + 1
+        self.min_x, self.min_y = lo * resolution
+        self.x_width, self.y_width = (int(w) for w in hi - lo + 1)
+        self.occupied = np.zeros((self.x_width, self.y_width), dtype=bool)
+        self.update_occupied(self.ob)
+
+    def calc_cells(self, px, py):
+        ix = np.rint((px - self.min_x) / self.resolution).astype(int)
+        iy = np.rint((py - self.min_y) / self.resolution).astype(int)
+        inside = ((0 <= ix) & (ix < self.x_width)
+                  & (0 <= iy) & (iy < self.y_width))
+        return ix, iy, inside
+
+    def update_occupied(self, points):
+        ix, iy, _ = self.calc_cells(points[:, 0], points[:, 1])
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cx, cy = ix + dx, iy + dy
+                inside = ((0 <= cx) & (cx < self.x_width)
+                          & (0 <= cy) & (cy < self.y_width))
+                self.occupied[cx[inside], cy[inside]] = True
+
+    def add_obstacles(self, points):
+        """
+        Add obstacles, marking only their cells. Obstacles off the grid
+        are only kept in the KD-tree.
+
+        points: [[x(m), y(m)], ...]
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        super().add_obstacles(points)
+        self.update_occupied(points)
+
+    def calc_occupied(self, px, py):
+        """
+        whether each point is in a marked cell
+        """
+        ix, iy, inside = self.calc_cells(px, py)
+        occupied = np.zeros(len(px), dtype=bool)
+        occupied[inside] = self.occupied[ix[inside], iy[inside]]
+        return occupied
+
+
+class ContactCache:
+    """
+    Obstacles that the curves of the last control tick ran into. From a
+    nearby pose, the next tick mostly runs into the same ones, so they
+    bound the first contact of each curve cheaply, and only the obstacles
+    that could be hit before that bound need to be searched again.
+    The contacts found from the same pose add up, so that the samples of
+    a tick that are searched in several batches also bound each other.
+    """
+
+    def __init__(self):
+        self.ob_index = None
+        self.n_ob = 0
+        self.pose = None
+        # contacts found from pose, and from the pose before it
+        self.contacts = np.zeros((0, 2))
+        self.last_contacts = np.zeros((0, 2))
+
+    def get_contacts(self, ob_index, x):
+        """
+        contact obstacles of the last tick, and of the searches from x so
+        far, if they are still obstacles of ob_index
+        """
+        if ob_index is not self.ob_index or len(ob_index.ob) < self.n_ob:
+            return np.zeros((0, 2))
+        if np.array_equal(x, self.pose):
+            return np.concatenate((self.last_contacts, self.contacts))
+        return self.contacts
+
+    def update(self, ob_index, contacts, x):
+        if ob_index is not self.ob_index or len(ob_index.ob) < self.n_ob:
+            self.last_contacts = np.zeros((0, 2))
+            self.contacts = contacts
+        elif np.array_equal(x, self.pose):
+            self.contacts = np.unique(
+                np.concatenate((self.contacts, contacts)), axis=0)
+        else:
+            self.last_contacts = self.contacts
+            self.contacts = contacts
+        self.ob_index = ob_index
+        self.n_ob = len(ob_index.ob)
+        self.pose = np.array(x, dtype=float)
+
+
+class ObstacleSearchPool:
+    """
+    Persistent process pool that runs closest_obstacle_on_curves for
+    chunks of the samples of a window in parallel. The obstacles are put
+    once in shared memory, and each worker builds its own obstacle index
+    (and motion primitives for the "swept" check) when it starts, so a
+    control tick only sends the state and the samples. The distances come
+    back in the order of the samples, so the best sample is picked
+    exactly as without the pool.
+    """
+
+    def __init__(self, ob, config, n_workers=None):
+        """
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        config: simulation configuration, as it will be used by the
+            workers for the whole life of the pool
+        n_workers: number of worker processes, os.cpu_count() if None
+        """
+        ob = np.asarray(ob, dtype=float).reshape(-1, 2)
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        self.n_workers = n_workers
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=max(ob.nbytes, 1))
+        np.ndarray(ob.shape, dtype=float, buffer=self.shm.buf)[:] = ob
+        self.pool = multiprocessing.Pool(
+            n_workers, initializer=_init_search_worker,
+            initargs=(self.shm.name, ob.shape, config))
+        self.finalizer = weakref.finalize(
+            self, ObstacleSearchPool.release, self.pool, self.shm)
+
+    @staticmethod
+    def release(pool, shm):
+        pool.terminate()
+        pool.join()
+        shm.close()
+        shm.unlink()
+
+    def close(self):
+        self.finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def closest_obstacle_on_curves(self, x, v, omega):
+        """
+        closest_obstacle_on_curves of the pool's obstacles and config, in
+        n_workers chunks of the samples
+        """
+        chunks = [(x, v_chunk, omega_chunk) for v_chunk, omega_chunk in
+                  zip(np.array_split(v, self.n_workers),
+                      np.array_split(omega, self.n_workers))
+                  if len(v_chunk) > 0]
+        if len(chunks) == 0:
+            return np.zeros(0)
+        return np.concatenate(self.pool.map(_search_worker, chunks))
+
+
+# obstacle search state of the current ObstacleSearchPool worker process
+_worker_shm = None
+_worker_search = None
+
+
+def _init_search_worker(shm_name, shape, config):
+    global _worker_shm, _worker_search
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    ob = np.ndarray(shape, dtype=float, buffer=_worker_shm.buf)
+    if config.collision_check == "swept":
+        primitives = MotionPrimitives(config)
+    else:
+        primitives = None
+    _worker_search = ob, config, calc_obstacle_index(ob, config), primitives
+
+
+def _search_worker(chunk):
+    x, v, omega = chunk
+    ob, config, ob_index, primitives = _worker_search
+    return closest_obstacle_on_curves(x, ob, v, omega, config, ob_index,
+                                      primitives=primitives)
+
+
+class WindowCoverage:
+    """
+    How much of its dynamic window the last dwa_control call covered: the
+    samples whose obstacles were searched, and those that were not but
+    whose goal and speed costs alone already exceed the selected one
+    """
+
+    def __init__(self):
+        self.n_samples = 0
+        self.n_searched = 0
+        self.n_pruned = 0
+
+    @property
+    def fraction(self):
+        """
+        share of the samples covered, 1 for an empty window
+        """
+        if self.n_samples == 0:
+            return 1.0
+        return (self.n_searched + self.n_pruned) / self.n_samples
+
+    @property
+    def complete(self):
+        """
+        whether the selected control is the one of a full search
+        """
+        return self.n_searched + self.n_pruned == self.n_samples
+
+    def update(self, n_samples, n_searched, n_pruned):
+        self.n_samples = n_samples
+        self.n_searched = n_searched
+        self.n_pruned = n_pruned
+
+
 class RobotType(Enum):
     circle = 0
     rectangle = 1
@@ -71,6 +650,54 @@ class Config:
         self.dt = 0.1  # [s] Time tick for motion prediction
         self.predict_time = 1.0  # [s]
         self.check_time = 100.0 # [s] Time to check for collision - a large number
+        # "analytic": first contact in closed form along each arc
+        # "simulate": step the motion model every dt up to check_time
+        # "trace": skip the steps that the clearance to the nearest
+        # obstacle proves free (sphere tracing)
+        # "swept": look up the cells each motion primitive sweeps over
+        # predict_time in an occupancy grid of swept_cell_resolution, and
+        # check the rest of the curves in closed form; contacts are never
+        # found later than they are, and at most 3.6 cells early in
+        # clearance
+        self.collision_check = "analytic"
+        self.swept_cell_resolution = 0.05  # [m]
+        # [m] safety margin on the clearances of the "trace" check, on top
+        # of the error of a distance field
+        self.trace_tolerance = 1e-6
+        # obstacle cost below which an obstacle is ignored, so that each
+        # curve is only checked up to where neither its admissibility nor
+        # its obstacle cost can change by more than this; 0 to check up
+        # to check_time
+        self.obstacle_cost_saturation = 0.0
+        # sample the window on a fixed lattice of inputs whose trajectories
+        # are computed once, see MotionPrimitives
+        self.motion_primitives = False
+        # search obstacles only for the samples whose goal and speed costs
+        # alone do not already exceed the best cost found (same result)
+        self.branch_and_bound = True
+        # search the window on a grid coarse_to_fine_factor times coarser
+        # first, then on finer and finer grids around the
+        # coarse_to_fine_candidates best samples; 1 to search every sample
+        self.coarse_to_fine_factor = 1
+        self.coarse_to_fine_candidates = 3
+        # [s] wall-clock budget of one dwa_control call, 0 for none. The
+        # samples are then searched from the lowest goal and speed costs,
+        # and the best one found when the budget runs out is used. The
+        # rollout and the goal and speed costs of the whole window come
+        # first and are not bounded by it; if they use up the budget, no
+        # sample is searched and the robot stops
+        self.control_time_budget = 0.0
+        # grid resolution of the distance field that the simulated rollout
+        # reads clearances from, 0 to look them up exactly
+        self.distance_field_resolution = 0.0  # [m]
+        # number of worker processes that search obstacles for the
+        # samples in parallel (see ObstacleSearchPool), 1 to search them in
+        # this process
+        self.n_workers = 1
+        # number of headings of the configuration-space bitmaps that box
+        # footprints are looked up in, 0 to check every pose exactly
+        self.configuration_space_yaw_bins = 0
+        self.configuration_space_resolution = 0.1  # [m]
         self.to_goal_cost_gain = 0.2
         self.speed_cost_gain = 1
         self.obstacle_cost_gain = 0.1
@@ -164,19 +791,263 @@ def predict_trajectory(x_init, v, y, config):
     """
 
     x = np.array(x_init)
-    trajectory = np.array(x)
-    time = 0
-    while time <= config.predict_time:
+    n_steps = calc_n_steps(config.predict_time, config.dt, inclusive=True)
+    trajectory = np.empty((n_steps + 1, len(x)))
+    trajectory[0] = x
+    for i in range(n_steps):
         x = motion(x, [v, y], config.dt)
-        trajectory = np.vstack((trajectory, x))
-        time += config.dt
+        trajectory[i + 1] = x
 
     return trajectory
 
 
-def calc_control_and_trajectory(x, dw, config, goal, ob):
+def calc_n_steps(duration, dt, inclusive):
+    """
+    number of motion steps of a `while time < duration` loop (or
+    `time <= duration` if inclusive) that adds dt to time at each step
+    """
+    n, time = 0, 0
+    while time <= duration if inclusive else time < duration:
+        n += 1
+        time += dt
+    return n
+
+
+def rollout(x_init, v, y, dt, n_steps):
+    """
+    apply motion n_steps times to each of many inputs
+    Positions and yaws are accumulated in the same order as motion does.
+    Parameters:
+        x_init: initial (x(m), y(m), yaw(rad)), scalars or one per input
+        v: translational velocities (m/s), shape (n,)
+        y: angular velocities (rad/s), shape (n,)
+        dt: time interval (s)
+        n_steps: number of steps
+    Returns:
+        px, py, yaw: states after each step, shape (n, n_steps)
+    """
+    n = len(v)
+    px0, py0, yaw0 = (np.broadcast_to(np.asarray(a, dtype=float), (n,))
+                      for a in x_init)
+    yaw = np.empty((n, n_steps + 1))
+    yaw[:, 0] = yaw0
+    yaw[:, 1:] = (y * dt)[:, None]
+    yaw = np.cumsum(yaw, axis=1)[:, 1:]
+    px = np.empty((n, n_steps + 1))
+    px[:, 0] = px0
+    px[:, 1:] = v[:, None] * np.cos(yaw) * dt
+    py = np.empty((n, n_steps + 1))
+    py[:, 0] = py0
+    py[:, 1:] = v[:, None] * np.sin(yaw) * dt
+    return np.cumsum(px, axis=1)[:, 1:], np.cumsum(py, axis=1)[:, 1:], yaw
+
+
+def predict_trajectories(x_init, v, y, config):
+    """
+    predict trajectories of many inputs at once, like predict_trajectory
+    Parameters:
+        x_init: initial state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        v: translational velocities (m/s), shape (n,)
+        y: angular velocities (rad/s), shape (n,)
+        config: simulation configuration
+    Returns:
+        trajectories: predicted trajectories, shape (n, steps + 1, 5)
+            [[[x, y, yaw, v, omega], ...], ...]
+    """
+    n_steps = calc_n_steps(config.predict_time, config.dt, inclusive=True)
+    trajectories = np.empty((len(v), n_steps + 1, 5))
+    trajectories[:, 0] = x_init
+    trajectories[:, 1:, 0], trajectories[:, 1:, 1], trajectories[:, 1:, 2] = \
+        rollout(x_init[:3], v, y, config.dt, n_steps)
+    trajectories[:, 1:, 3] = v[:, None]
+    trajectories[:, 1:, 4] = y[:, None]
+    return trajectories
+
+
+class MotionPrimitives:
+    """
+    Trajectories from the origin of every input on a fixed lattice of the
+    inputs a Config allows, computed once. At constant inputs, the
+    trajectory from any pose is the one from the origin moved by a rigid
+    transform, so a control tick only rotates and translates the ones in
+    its dynamic window instead of applying motion again.
+    The cells that the footprint sweeps along each input over the same
+    predicted steps are kept the same way for the "swept" collision
+    check. They are computed on first use.
+    """
+
+    # number of inputs whose swept cells are kept
+    swept_cells_size = 4096
+    # number of inputs whose swept cells are built together
+    sweep_batch_size = 64
+
+    def __init__(self, config):
+        """
+        config: simulation configuration
+        """
+        n_v = int(round((config.max_speed - config.min_speed)
+                        / config.v_resolution)) + 1
+        self.v = config.min_speed + config.v_resolution * np.arange(n_v)
+        n_omega = int(round(config.max_yaw_rate
+                            / config.yaw_rate_resolution))
+        self.omega = config.yaw_rate_resolution * np.arange(-n_omega,
+                                                            n_omega + 1)
+        n_steps = calc_n_steps(config.predict_time, config.dt, inclusive=True)
+        v, y = np.meshgrid(self.v, self.omega, indexing="ij")
+        px, py, yaw = rollout((0.0, 0.0, 0.0), v.ravel(), y.ravel(),
+                              config.dt, n_steps)
+        shape = (len(self.v), len(self.omega), n_steps)
+        self.points = np.stack((px, py), axis=-1).reshape(shape + (2,))
+        self.yaw = yaw.reshape(shape)
+
+        self.v_resolution = config.v_resolution
+        self.yaw_rate_resolution = config.yaw_rate_resolution
+        self.dt = config.dt
+        self.footprint = calc_footprint(config)
+        self.swept_cell_resolution = config.swept_cell_resolution
+        # the tables stop at the predicted steps, or earlier at the
+        # collision check horizon
+        self.swept_steps = np.minimum(n_steps, calc_horizon_steps(
+            self.v, config,
+            calc_n_steps(config.check_time, config.dt, inclusive=False)))
+        self.swept_cells = OrderedDict()
+
+    def select(self, dw):
+        """
+        lattice inputs in a dynamic window, in the order of a v-major scan
+        Parameters:
+            dw: dynamic window
+                [v_min, v_max, yaw_rate_min, yaw_rate_max]
+        Returns:
+            iv, iw: indices into self.v and self.omega
+        """
+        iv = np.flatnonzero((dw[0] <= self.v) & (self.v < dw[1]))
+        iw = np.flatnonzero((dw[2] <= self.omega) & (self.omega < dw[3]))
+        return np.repeat(iv, len(iw)), np.tile(iw, len(iv))
+
+    def calc_trajectories(self, x, iv, iw):
+        """
+        predicted trajectories of lattice inputs from a state
+        Parameters:
+            x: current state
+                [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+            iv, iw: indices into self.v and self.omega
+        Returns:
+            trajectories: predicted trajectories, shape (n, steps + 1, 5)
+                [[[x, y, yaw, v, omega], ...], ...]
+        """
+        cos_yaw, sin_yaw = math.cos(x[2]), math.sin(x[2])
+        rotation = np.array([[cos_yaw, sin_yaw], [-sin_yaw, cos_yaw]])
+        trajectories = np.empty((len(iv), self.yaw.shape[2] + 1, 5))
+        trajectories[:, 0] = x
+        trajectories[:, 1:, :2] = self.points[iv, iw] @ rotation + x[:2]
+        trajectories[:, 1:, 2] = self.yaw[iv, iw] + x[2]
+        trajectories[:, 1:, 3] = self.v[iv, None]
+        trajectories[:, 1:, 4] = self.omega[iw, None]
+        return trajectories
+
+    def calc_indices(self, v, omega):
+        """
+        indices into self.v and self.omega of lattice inputs
+        """
+        iv = np.rint((v - self.v[0]) / self.v_resolution).astype(int)
+        iw = np.rint(omega / self.yaw_rate_resolution).astype(int)
+        return iv, iw + len(self.omega) // 2
+
+    def calc_swept_cells(self, iv, iw):
+        """
+        cells swept by the footprint along lattice inputs from the origin,
+        over self.swept_steps steps, built on first use
+        A cell is swept at a step if any obstacle within the footprint at
+        that step lies in it.
+        Parameters:
+            iv, iw: indices into self.v and self.omega, shape (n,)
+        Returns:
+            cells: (m, 2) integer cell coordinates, in resolution units, of
+                the cells swept along each input in turn
+            steps: index of the step first sweeping each cell, shape (m,)
+            sizes: number of cells of each input, shape (n,)
+        """
+        keys = list(zip(iv.tolist(), iw.tolist()))
+        missing = [key for key in dict.fromkeys(keys)
+                   if key not in self.swept_cells]
+        for start in range(0, len(missing), self.sweep_batch_size):
+            batch = missing[start:start + self.sweep_batch_size]
+            self.swept_cells.update(zip(batch, self.sweep(*np.array(batch).T)))
+        tables = []
+        for key in keys:
+            self.swept_cells.move_to_end(key)
+            tables.append(self.swept_cells[key])
+        while len(self.swept_cells) > self.swept_cells_size:
+            self.swept_cells.popitem(last=False)
+        cells, steps = zip(*tables)
+        return (np.concatenate(cells), np.concatenate(steps),
+                np.array([len(k) for k in steps]))
+
+    def sweep(self, iv, iw):
+        """
+        cells first swept by lattice inputs, over self.swept_steps steps
+        Poses are stamped every few steps, while the footprint moves by
+        less than half a cell in between, with the cells around each
+        stamped pose widened by that motion. A stamped cell is within
+        resolution / sqrt(2) of any point in it.
+        Returns:
+            tables: (cells, steps) of each input, as calc_swept_cells
+        """
+        half_length, half_width, radius = self.footprint
+        resolution = self.swept_cell_resolution
+        n_steps = self.swept_steps[iv]
+        # farthest that a point of the footprint moves in one step
+        motion_step = (np.abs(self.v[iv]) + math.hypot(half_length, half_width)
+                       * np.abs(self.omega[iw])) * self.dt
+        with np.errstate(divide="ignore"):
+            stride = np.maximum(1, np.minimum(resolution / 2 / motion_step,
+                                              n_steps).astype(int))
+        margin = (radius + resolution / math.sqrt(2)
+                  + (stride - 1) * motion_step)
+        # a cell within reach of a pose is within this many cells of the
+        # cell of the pose
+        n = (math.hypot(half_length, half_width) + margin.max()
+             + resolution / math.sqrt(2)) / resolution
+        # the stamped poses k = 0, stride, 2 * stride, ... of each input
+        counts = -(-n_steps // stride)
+        sample = np.repeat(np.arange(len(iv)), counts)
+        k = (np.arange(len(sample))
+             - np.repeat(np.cumsum(counts) - counts, counts)) * stride[sample]
+        px, py = self.points[iv[sample], iw[sample], k].T
+        yaw = self.yaw[iv[sample], iw[sample], k]
+
+        # the cells around each stamped pose, pose by pose
+        dx, dy = np.meshgrid(np.arange(-int(n), int(n) + 1),
+                             np.arange(-int(n), int(n) + 1), indexing="ij")
+        near = np.hypot(dx, dy) <= n
+        cx = (np.rint(px / resolution).astype(np.int32)[:, None]
+              + dx[near].astype(np.int32))
+        cy = (np.rint(py / resolution).astype(np.int32)[:, None]
+              + dy[near].astype(np.int32))
+        d2 = calc_box_distance2(
+            np.stack((cx, cy), axis=-1) * resolution, px[:, None],
+            py[:, None], yaw[:, None], half_length, half_width)
+        pose, cell = np.nonzero(d2 <= margin[sample, None] ** 2)
+        cx, cy, sample = cx[pose, cell], cy[pose, cell], sample[pose]
+        # the first occurrence of a cell of an input is at its first pose
+        x_width = cx.max() - cx.min() + 1
+        y_width = cy.max() - cy.min() + 1
+        _, first = np.unique((sample * x_width + cx - cx.min()) * y_width
+                             + cy - cy.min(), return_index=True)
+        first.sort()
+        split = np.cumsum(np.bincount(sample[first], minlength=len(iv)))[:-1]
+        return zip(np.split(np.stack((cx[first], cy[first]), axis=1), split),
+                   np.split(k[pose[first]].astype(np.int32), split))
+
+
+def calc_control_and_trajectory(x, dw, config, goal, ob, ob_index=None,
+                                primitives=None, contact_cache=None,
+                                pool=None, deadline=None, coverage=None):
     """
     calculation final input with dynamic window
+    All samples of the window are evaluated at once with array operations.
     Parameters:
         x: current state
             [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
@@ -187,6 +1058,13 @@ def calc_control_and_trajectory(x, dw, config, goal, ob):
             [x(m), y(m)]
         ob: obstacle positions 
             [[x(m), y(m)], ...]
+        ob_index: ObstacleIndex of ob, optional
+        primitives: MotionPrimitives of config, optional
+        contact_cache: ContactCache, optional
+        pool: ObstacleSearchPool of ob and config, optional
+        deadline: time.perf_counter() value by which to stop searching
+            obstacles, optional
+        coverage: WindowCoverage, optional
     Returns:
         best_u: selected control input
             [v(m/s), omega(rad/s)]
@@ -194,51 +1072,247 @@ def calc_control_and_trajectory(x, dw, config, goal, ob):
             [[x, y, yaw, v, omega], ...]
     """
 
-    min_cost = float("inf")
-    best_u = [0.0, 0.0]
-    best_trajectory = np.array([x])
+    # sampled inputs in dynamic window, in the order of a v-major scan
+    if primitives is None:
+        v, y = np.meshgrid(np.arange(dw[0], dw[1], config.v_resolution),
+                           np.arange(dw[2], dw[3], config.yaw_rate_resolution),
+                           indexing="ij")
+        shape = v.shape
+        v, y = v.ravel(), y.ravel()
+    else:
+        iv, iw = primitives.select(dw)
+        shape = len(np.unique(iv)), len(np.unique(iw))
+        v, y = primitives.v[iv], primitives.omega[iw]
+
+    if primitives is None:
+        trajectories = predict_trajectories(x, v, y, config)
+    else:
+        trajectories = primitives.calc_trajectories(x, iv, iw)
+    # calc cost
+    to_goal_cost = config.to_goal_cost_gain * calc_to_goal_costs(trajectories, goal)
+    speed_cost = config.speed_cost_gain * (config.max_speed - trajectories[:, -1, 3])
+
+    # admissible velocities check
+    if deadline is not None:
+        # anytime search, from the samples of lowest goal and speed costs
+        dist = search_obstacles_by_bound(x, ob, v, y, to_goal_cost + speed_cost,
+                                         config, ob_index, contact_cache,
+                                         primitives, pool, deadline=deadline)
+    elif config.coarse_to_fine_factor > 1:
+        dist = search_obstacles_coarse_to_fine(
+            x, ob, v, y, to_goal_cost + speed_cost, shape, config, ob_index,
+            contact_cache, primitives, pool)
+    elif config.branch_and_bound and not save_costs_fig and np.all(v >= 0):
+        dist = search_obstacles_by_bound(x, ob, v, y, to_goal_cost + speed_cost,
+                                         config, ob_index, contact_cache,
+                                         primitives, pool)
+    else:
+        dist = closest_obstacle_on_curves(x, ob, v, y, config, ob_index,
+                                          contact_cache, primitives, pool)
+    # dist is nan for the samples that were not searched
+    searched = ~np.isnan(dist)
+    bound = to_goal_cost + speed_cost
+    forward = np.all(v >= 0)
+    admissible = searched & ~(v > np.sqrt(2*config.max_accel*dist))
+    if coverage is not None:
+        coverage.update(len(v), np.count_nonzero(searched), 0)
+    v, y, dist = v[admissible], y[admissible], dist[admissible]
+    if len(v) == 0:
+        return [0.0, 0.0], np.array([x])
+    trajectories = trajectories[admissible]
+    to_goal_cost, speed_cost = to_goal_cost[admissible], speed_cost[admissible]
+    ob_cost = calc_obstacle_costs(dist, config)
+
+    final_cost = to_goal_cost + speed_cost + ob_cost
+
+    # search minimum trajectory: the last sample of minimum cost, as a
+    # scan keeping the sample whenever min_cost >= final_cost would
+    best = len(final_cost) - 1 - np.argmin(final_cost[::-1])
+    best_u = [v[best], y[best]]
+    best_trajectory = trajectories[best]
+
+    if coverage is not None and forward:
+        # obstacle costs are never negative for v >= 0, see
+        # search_obstacles_by_bound
+        coverage.n_pruned = np.count_nonzero(
+            ~searched & (bound > final_cost[best]))
 
-    # evaluate all trajectory with sampled input in dynamic window
-    for v in np.arange(dw[0], dw[1], config.v_resolution):
-        for y in np.arange(dw[2], dw[3], config.yaw_rate_resolution):
+    if save_costs_fig:
+        # costs of every sample such a scan would have kept on its way
+        prev_min = np.minimum.accumulate(np.concatenate(([np.inf], final_cost[:-1])))
+        kept = final_cost <= prev_min
+        to_goal_cost_list.extend(to_goal_cost[kept])
+        speed_cost_list.extend(speed_cost[kept])
+        ob_cost_list.extend(ob_cost[kept])
+
+    if abs(best_u[0]) < config.robot_stuck_flag_cons \
+            and abs(x[3]) < config.robot_stuck_flag_cons:
+        # to ensure the robot do not get stuck in
+        # best v=0 m/s (in front of an obstacle) and
+        # best omega=0 rad/s (heading to the goal with
+        # angle difference of 0)
+        best_u[1] = -config.max_delta_yaw_rate
+    return best_u, best_trajectory
 
-            # admissible velocities check
-            dist, _ = closest_obstacle_on_curve(x.copy(), ob, v, y, config)
-            if v > math.sqrt(2*config.max_accel*dist):
-                continue
-            # if y > math.sqrt(2*config.max_delta_yaw_rate*dist):
-            #     continue
 
-            trajectory = predict_trajectory(x.copy(), v, y, config)
-            # calc cost
-            to_goal_cost = config.to_goal_cost_gain * calc_to_goal_cost(trajectory, goal)
-            speed_cost = config.speed_cost_gain * (config.max_speed - trajectory[-1, 3])
-            if dist == 0:
-                ob_cost = float("Inf")
+def search_obstacles_by_bound(x, ob, v, omega, bound, config, ob_index=None,
+                              contact_cache=None, primitives=None, pool=None,
+                              batch_size=16, deadline=None):
+    """
+    closest_obstacle_on_curves, only for the samples that can still be the
+    best one
+    The obstacle cost is never negative for v >= 0, so the goal and speed
+    costs of a sample are a lower bound of its final cost. Samples are
+    searched in order of that bound, in growing batches, until the bound
+    of the next one exceeds the best final cost found so far. The samples
+    left out cost more than the best one, so the selected sample does not
+    change. With a negative v in the window, the bound is only used as
+    the search order.
+    With a deadline, no batch is started after it, not even the first.
+    The first batch is then a single sample that measures the search
+    rate, and the later ones are cut to what that rate fits in the time
+    left. The best sample is then the best one of the samples searched.
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        bound: goal cost + speed cost of each sample, shape (n,)
+        config: simulation configuration
+        ob_index: ObstacleIndex of ob, optional
+        contact_cache: ContactCache, optional. The contacts of the last
+            tick and of the batches before bound those of each batch.
+        primitives: MotionPrimitives of config, optional
+        pool: ObstacleSearchPool of ob and config, optional
+        batch_size: number of samples in the first batch
+        deadline: time.perf_counter() value after which no batch is
+            started, optional
+    Returns:
+        dist: distance to the closest obstacle of each input, nan for the
+            samples that were not searched, shape (n,)
+    """
+    dist = np.full(len(v), np.nan)
+    order = np.argsort(bound, kind="stable")
+    prune = np.all(v >= 0)
+    best_cost = np.inf
+    start = 0
+    started = time.perf_counter()
+    while start < len(order):
+        if prune and bound[order[start]] > best_cost:
+            break
+        size = batch_size
+        if deadline is not None:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if start == 0:
+                # no search rate to size the batch from yet
+                size = 1
             else:
-                ob_cost = config.obstacle_cost_gain * (1 / dist)
-
-            final_cost = to_goal_cost + speed_cost + ob_cost
-
-            # search minimum trajectory
-            if min_cost >= final_cost:
-                min_cost = final_cost
-                best_u = [v, y]
-                best_trajectory = trajectory
-
-                if save_costs_fig:
-                    to_goal_cost_list.append(to_goal_cost)
-                    speed_cost_list.append(speed_cost)
-                    ob_cost_list.append(ob_cost)
-
-                if abs(best_u[0]) < config.robot_stuck_flag_cons \
-                        and abs(x[3]) < config.robot_stuck_flag_cons:
-                    # to ensure the robot do not get stuck in
-                    # best v=0 m/s (in front of an obstacle) and
-                    # best omega=0 rad/s (heading to the goal with
-                    # angle difference of 0)
-                    best_u[1] = -config.max_delta_yaw_rate
-    return best_u, best_trajectory
+                # no more samples than the rate so far allows in the time
+                # left
+                batch_size = size = min(batch_size, max(
+                    1, int(start * (deadline - now) / (now - started))))
+        batch = order[start:start + size]
+        if prune:
+            batch = batch[bound[batch] <= best_cost]
+        dist[batch] = closest_obstacle_on_curves(
+            x, ob, v[batch], omega[batch], config, ob_index, contact_cache,
+            primitives, pool)
+        admissible = ~(v[batch] > np.sqrt(2*config.max_accel*dist[batch]))
+        final_cost = bound[batch] + calc_obstacle_costs(dist[batch], config)
+        best_cost = min(best_cost, final_cost[admissible].min(initial=np.inf))
+        start += size
+        if size == batch_size:
+            batch_size *= 2
+    return dist
+
+
+def search_obstacles_coarse_to_fine(x, ob, v, omega, bound, shape, config,
+                                    ob_index=None, contact_cache=None,
+                                    primitives=None, pool=None):
+    """
+    closest_obstacle_on_curves, only for the samples of a coarse-to-fine
+    search of the window
+    The samples on a grid config.coarse_to_fine_factor times coarser than
+    the window are searched first. Then, with the grid step halved each
+    time, the 3 x 3 neighbours of the config.coarse_to_fine_candidates
+    cheapest samples so far are searched, down to the window resolution.
+    If no searched sample is admissible with a finite cost, the whole
+    window is searched.
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        bound: goal cost + speed cost of each sample, shape (n,)
+        shape: (number of v, number of omega) of the window grid, with
+            the samples in the order of a v-major scan
+        config: simulation configuration
+        ob_index: ObstacleIndex of ob, optional
+        contact_cache: ContactCache, optional
+        primitives: MotionPrimitives of config, optional
+        pool: ObstacleSearchPool of ob and config, optional
+    Returns:
+        dist: distance to the closest obstacle of each input, nan for the
+            samples that were not searched, shape (n,)
+    """
+    n_v, n_omega = shape
+    dist = np.full(len(v), np.nan)
+    final_cost = np.full(len(v), np.inf)
+
+    def search(samples):
+        samples = np.unique(samples)
+        samples = samples[np.isnan(dist[samples])]
+        if len(samples) == 0:
+            return
+        dist[samples] = closest_obstacle_on_curves(
+            x, ob, v[samples], omega[samples], config, ob_index,
+            contact_cache, primitives, pool)
+        admissible = ~(v[samples] > np.sqrt(2*config.max_accel*dist[samples]))
+        final_cost[samples] = np.where(
+            admissible,
+            bound[samples] + calc_obstacle_costs(dist[samples], config),
+            np.inf)
+
+    if len(v) == 0:
+        return dist
+    factor = config.coarse_to_fine_factor
+    coarse_v = np.union1d(np.arange(0, n_v, factor), [n_v - 1])
+    coarse_omega = np.union1d(np.arange(0, n_omega, factor), [n_omega - 1])
+    search((coarse_v[:, None] * n_omega + coarse_omega[None, :]).ravel())
+
+    offsets = np.array([-1, 0, 1])
+    while factor > 1:
+        factor = (factor + 1) // 2
+        # cheapest samples first, later ones first among equal costs
+        order = np.lexsort((-np.arange(len(v)), final_cost))
+        best = order[:config.coarse_to_fine_candidates]
+        best = best[np.isfinite(final_cost[best])]
+        if len(best) == 0:
+            search(np.arange(len(v)))
+            break
+        best_v, best_omega = np.divmod(best, n_omega)
+        near_v = np.clip(best_v[:, None] + factor * offsets, 0, n_v - 1)
+        near_omega = np.clip(best_omega[:, None] + factor * offsets,
+                             0, n_omega - 1)
+        search((near_v[:, :, None] * n_omega
+                + near_omega[:, None, :]).ravel())
+    return dist
+
+
+def calc_obstacle_costs(dist, config):
+    """
+    obstacle costs of many samples from their distances to the closest
+    obstacle, infinite at distance 0
+    """
+    with np.errstate(divide="ignore"):
+        return np.where(dist == 0, np.inf,
+                        config.obstacle_cost_gain * (1 / dist))
 
 
 def closest_obstacle_on_curve(x, ob, v, omega, config):
@@ -268,6 +1342,655 @@ def closest_obstacle_on_curve(x, ob, v, omega, config):
     return float("Inf"), float("Inf")
 
 
+def closest_obstacle_on_curves(x, ob, v, omega, config, ob_index=None,
+                               contact_cache=None, primitives=None,
+                               pool=None):
+    """
+    closest_obstacle_on_curve for many inputs at once
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        config: simulation configuration
+        ob_index: ObstacleIndex of ob, optional
+        contact_cache: ContactCache, optional. Used by the closed-form
+            check when ob_index is given.
+        primitives: MotionPrimitives of config, needed by the "swept"
+            check, whose inputs must be on their lattice
+        pool: ObstacleSearchPool of ob and config, optional. The inputs
+            are then searched in its workers, without the contact cache.
+    Returns:
+        dist: distance to the closest obstacle of each input, shape (n,)
+    """
+    if pool is not None:
+        return pool.closest_obstacle_on_curves(x, v, omega)
+    n_steps = calc_horizon_steps(
+        v, config, calc_n_steps(config.check_time, config.dt, inclusive=False))
+    if (config.collision_check == "analytic" and ob_index is not None
+            and contact_cache is not None):
+        first = first_contact_from_cache(x, v, omega, config.dt,
+                                         n_steps.max(initial=0),
+                                         calc_footprint(config), ob_index,
+                                         contact_cache)
+    elif config.collision_check == "analytic":
+        first = first_contact_on_arcs(x, ob, v, omega, config.dt,
+                                      n_steps.max(initial=0),
+                                      calc_footprint(config), ob_index)
+    elif config.collision_check == "simulate":
+        first = first_contact_by_simulation(x, ob, v, omega, config.dt,
+                                            n_steps, calc_footprint(config),
+                                            ob_index)
+    elif config.collision_check == "trace":
+        first = first_contact_by_tracing(x, ob, v, omega, config.dt, n_steps,
+                                         calc_footprint(config), ob_index,
+                                         config.trace_tolerance)
+    elif config.collision_check == "swept":
+        if primitives is None:
+            raise ValueError("The swept collision check needs primitives")
+        if not isinstance(ob_index, OccupancyGrid):
+            ob_index = OccupancyGrid(ob, config.swept_cell_resolution)
+        first = first_contact_by_sweeping(x, v, omega, n_steps, primitives,
+                                          ob_index)
+    else:
+        raise ValueError("Invalid collision check")
+
+    return calc_contact_distances(first, n_steps, v, config.dt)
+
+
+def calc_contact_distances(first, n_steps, v, dt):
+    """
+    distance travelled along each curve up to its first colliding step,
+    accumulated step by step like closest_obstacle_on_curve does
+    Parameters:
+        first: index of the first colliding step of each input, n_steps if
+            there is none
+        n_steps: number of steps checked, or one per input
+        v: translational velocities (m/s), shape (n,)
+        dt: time interval (s)
+    Returns:
+        dist: distance to the closest obstacle of each input, shape (n,)
+    """
+    dist = np.full(len(v), np.inf)
+    collided = first < n_steps
+    if np.any(collided):
+        increments = np.zeros((np.count_nonzero(collided), first.max() + 1))
+        increments[:, 1:] = (v[collided] * dt)[:, None]
+        dist[collided] = np.cumsum(increments, axis=1)[
+            np.arange(len(increments)), first[collided]]
+    return dist
+
+
+def calc_horizon_steps(v, config, n_steps):
+    """
+    number of steps to check for collisions along each curve
+    With config.obstacle_cost_saturation > 0, a curve is only checked as
+    far as an obstacle could still make it inadmissible or cost more than
+    obstacle_cost_saturation.
+    Parameters:
+        v: translational velocities (m/s), shape (n,)
+        config: simulation configuration
+        n_steps: number of steps up to check_time
+    Returns:
+        n_steps: number of steps of each input, shape (n,)
+    """
+    limit = np.full(len(v), n_steps)
+    if config.obstacle_cost_saturation <= 0:
+        return limit
+    # v <= max_speed is admissible and obstacle_cost_gain / dist is below
+    # the saturation for any dist beyond this horizon
+    horizon = max(config.max_speed ** 2 / (2 * config.max_accel),
+                  config.obstacle_cost_gain / config.obstacle_cost_saturation)
+    step = np.abs(np.asarray(v, dtype=float) * config.dt)
+    moving = step > 0
+    # the contact at step index k is at dist = k * |v| * dt
+    limit[moving] = np.minimum(np.floor(horizon / step[moving]) + 1, n_steps)
+    return limit
+
+
+def calc_obstacle_index(ob, config, footprint=None):
+    """
+    lookup structure of an obstacle set for dwa_control, to be built once
+    per obstacle set
+    Parameters:
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        config: simulation configuration
+        footprint: (half_length(m), half_width(m), radius(m)),
+            calc_footprint(config) if None
+    Returns:
+        ob_index: OccupancyGrid for the "swept" collision check, else
+            ConfigurationSpace if config.configuration_space_yaw_bins > 0
+            and the footprint is a box, else DistanceField if
+            config.distance_field_resolution > 0, else ObstacleIndex
+    """
+    if config.collision_check == "swept":
+        return OccupancyGrid(ob, config.swept_cell_resolution)
+    if footprint is None:
+        footprint = calc_footprint(config)
+    if (config.configuration_space_yaw_bins > 0
+            and (footprint[0] > 0 or footprint[1] > 0)):
+        return ConfigurationSpace.cached(
+            ob, footprint, config.configuration_space_resolution,
+            config.configuration_space_yaw_bins)
+    if config.distance_field_resolution <= 0:
+        return ObstacleIndex(ob)
+    reach = math.hypot(footprint[0], footprint[1]) + footprint[2]
+    return DistanceField(ob, config.distance_field_resolution,
+                         max_distance=2 * reach)
+
+
+def calc_footprint(config):
+    """
+    collision footprint of the robot
+    The robot collides with the obstacles within radius of a
+    (2 * half_length) x (2 * half_width) box around it, aligned with its
+    heading. In this version of codes both robot types are checked as a
+    circle of robot_radius.
+    Parameters:
+        config: simulation configuration
+    Returns:
+        footprint: (half_length(m), half_width(m), radius(m))
+    """
+    return 0.0, 0.0, config.robot_radius
+
+
+def first_contact_by_simulation(x, ob, v, omega, dt, n_steps, footprint,
+                                ob_index=None):
+    """
+    first colliding step of many inputs, by applying motion step by step
+    The curves are rolled out a block of steps at a time, and only the
+    inputs without a collision so far are carried on to the next block.
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        dt: time interval (s)
+        n_steps: number of steps to check, or one per input
+        footprint: (half_length(m), half_width(m), radius(m))
+        ob_index: ObstacleIndex of ob, optional. With it, each rolled out
+            pose is only checked against the obstacles near it, or looked
+            up in the bitmaps of a ConfigurationSpace.
+    Returns:
+        first: index of the first colliding step of each input (0 for the
+            first step), n_steps if there is none
+    """
+    half_length, half_width, radius = footprint
+    n_steps = np.broadcast_to(n_steps, len(v))
+    first = n_steps.copy()
+    active = np.arange(len(v))
+    px, py, yaw = x[0], x[1], x[2]
+    step = 0
+    while step < n_steps.max(initial=0) and len(active) > 0 and len(ob) > 0:
+        n = min(50, n_steps.max() - step)
+        px, py, yaw = rollout((px, py, yaw), v[active], omega[active], dt, n)
+        d2 = np.full(px.shape, np.inf)
+        if ob_index is not None and half_length == 0 and half_width == 0:
+            d2 = ob_index.query_nearest(
+                np.stack((px.ravel(), py.ravel()), axis=1),
+                radius).reshape(px.shape)
+        elif ob_index is not None:
+            # exact, or from the bitmaps of a ConfigurationSpace
+            d2[ob_index.calc_hits(px.ravel(), py.ravel(), yaw.ravel(),
+                                  footprint).reshape(px.shape)] = 0.0
+        elif half_length == 0 and half_width == 0:
+            for ob_x, ob_y in ob:
+                np.minimum(d2, (px - ob_x) ** 2 + (py - ob_y) ** 2, out=d2)
+        else:
+            cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+            for ob_x, ob_y in ob:
+                # obstacle in the box frame, clamped to the box
+                dx, dy = ob_x - px, ob_y - py
+                bx = np.abs(cos_yaw * dx + sin_yaw * dy) - half_length
+                by = np.abs(-sin_yaw * dx + cos_yaw * dy) - half_width
+                np.maximum(bx, 0, out=bx)
+                np.maximum(by, 0, out=by)
+                np.minimum(d2, bx ** 2 + by ** 2, out=d2)
+        hit = np.sqrt(d2) <= radius
+        hit &= step + np.arange(n) < n_steps[active, None]
+        collided = hit.any(axis=1)
+        first[active[collided]] = step + np.argmax(hit[collided], axis=1)
+        carry_on = ~collided & (step + n < n_steps[active])
+        active = active[carry_on]
+        px, py, yaw = (a[carry_on, -1] for a in (px, py, yaw))
+        step += n
+    return first
+
+
+def first_contact_by_tracing(x, ob, v, omega, dt, n_steps, footprint,
+                             ob_index=None, tolerance=0.0):
+    """
+    first colliding step of many inputs, by conservative advancement
+    Each pose is at most |v| * dt away from the previous one, so when the
+    clearance of a pose exceeds the reach of the footprint by c, the next
+    ceil(c / (|v| * dt)) - 1 poses cannot collide and are skipped. The
+    collision itself is only checked at the poses close to an obstacle,
+    so the result is the same as first_contact_by_simulation.
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        dt: time interval (s)
+        n_steps: number of steps to check, or one per input
+        footprint: (half_length(m), half_width(m), radius(m))
+        ob_index: ObstacleIndex or DistanceField of ob, optional. The
+            clearances of a DistanceField are widened by its max_error.
+        tolerance: clearances are reduced by this margin (m), to absorb
+            their error
+    Returns:
+        first: index of the first colliding step of each input (0 for the
+            first step), n_steps if there is none
+    """
+    n_steps = np.broadcast_to(n_steps, len(v))
+    first = n_steps.copy()
+    if len(v) == 0 or len(ob) == 0:
+        return first
+    if ob_index is None:
+        ob_index = ObstacleIndex(ob)
+    tolerance += getattr(ob_index, "max_error", 0.0)
+    reach = math.hypot(footprint[0], footprint[1]) + footprint[2]
+    v = np.asarray(v, dtype=float)
+    delta = np.asarray(omega, dtype=float) * dt
+    step = np.abs(v * dt)
+
+    # number of motion steps of the pose checked next, per input
+    k = np.ones(len(v), dtype=int)
+    active = np.arange(len(v))
+    while len(active) > 0:
+        px, py, yaw = calc_poses(x, v[active], delta[active], dt, k[active])
+        margin = ob_index.calc_distance(px, py) - reach - tolerance
+        near = margin <= 0
+        hit = np.zeros(len(active), dtype=bool)
+        if np.any(near):
+            hit[near] = ob_index.calc_hits(px[near], py[near], yaw[near],
+                                           footprint)
+        first[active[hit]] = k[active[hit]] - 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            skip = np.where(near, 1, np.ceil(margin / step[active]))
+        # a robot turning on the spot never gets closer to an obstacle
+        skip[~near & (step[active] == 0)] = n_steps.max()
+        k[active] += np.minimum(skip, n_steps.max()).astype(int)
+        active = active[~hit & (k[active] <= n_steps[active])]
+    return first
+
+
+def first_contact_by_sweeping(x, v, omega, n_steps, primitives, grid):
+    """
+    first colliding step of many lattice inputs, from the cells swept
+    along each of them
+    The swept cells of each input over its table are moved to the current
+    pose and looked up in the occupancy grid all at once, so the work is
+    proportional to the swept area. With resolution the
+    swept_cell_resolution of both, a contact found there is never later
+    than the true one, and can be earlier by up to
+    (1 / sqrt(2) + 1 / 2 + 2 * sqrt(2)) * resolution of clearance. The
+    inputs still free at the end of their table are checked in closed
+    form for the remaining steps.
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        v: translational velocities (m/s), shape (n,), on the lattice
+        omega: angular velocities (rad/s), shape (n,), on the lattice
+        n_steps: number of steps to check, or one per input
+        primitives: MotionPrimitives
+        grid: OccupancyGrid of the obstacles
+    Returns:
+        first: index of the first colliding step of each input (0 for the
+            first step), n_steps if there is none
+    """
+    n_steps = np.broadcast_to(n_steps, len(v))
+    first = n_steps.copy()
+    if len(v) == 0:
+        return first
+    iv, iw = primitives.calc_indices(v, omega)
+    swept_steps = np.minimum(n_steps, primitives.swept_steps[iv])
+    cells, steps, sizes = primitives.calc_swept_cells(iv, iw)
+    sample = np.repeat(np.arange(len(v)), sizes)
+    cos_yaw, sin_yaw = math.cos(x[2]), math.sin(x[2])
+    rotation = np.array([[cos_yaw, sin_yaw], [-sin_yaw, cos_yaw]])
+    points = (cells * primitives.swept_cell_resolution) @ rotation + x[:2]
+    hit = (grid.calc_occupied(points[:, 0], points[:, 1])
+           & (steps < swept_steps[sample]))
+    np.minimum.at(first, sample[hit], steps[hit])
+
+    # no contact on the tables means none before their end
+    rest = np.flatnonzero((first == n_steps) & (swept_steps < n_steps))
+    if len(rest) > 0:
+        first[rest] = np.minimum(n_steps[rest], first_contact_on_arcs(
+            x, grid.ob, v[rest], omega[rest], primitives.dt,
+            n_steps[rest].max(), primitives.footprint, grid))
+    return first
+
+
+def calc_poses(x, v, delta, dt, k):
+    """
+    poses after k steps of motion at constant inputs, in closed form
+    Parameters:
+        x: initial state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        v: translational velocities (m/s), shape (n,)
+        delta: yaw change per step (rad), shape (n,)
+        dt: time interval (s)
+        k: number of steps, shape (n,)
+    Returns:
+        px, py, yaw: poses, each of shape (n,)
+    """
+    # sum over i = 1..k of v * dt * (cos, sin)(yaw + i * delta)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        length = np.where(delta == 0, k * v * dt,
+                          v * dt * np.sin(k * delta / 2) / np.sin(delta / 2))
+    heading = x[2] + (k + 1) * delta / 2
+    return (x[0] + length * np.cos(heading), x[1] + length * np.sin(heading),
+            x[2] + k * delta)
+
+
+def calc_box_distance2(ob, px, py, yaw, half_length, half_width):
+    """
+    squared distance from each obstacle to the (2 * half_length) x
+    (2 * half_width) box at a pose (px, py, yaw), 0 inside the box
+    """
+    dx, dy = ob[..., 0] - px, ob[..., 1] - py
+    cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+    bx = np.maximum(np.abs(cos_yaw * dx + sin_yaw * dy) - half_length, 0)
+    by = np.maximum(np.abs(-sin_yaw * dx + cos_yaw * dy) - half_width, 0)
+    return bx ** 2 + by ** 2
+
+
+def first_contact_on_arcs(x, ob, v, omega, dt, n_steps, footprint,
+                          ob_index=None):
+    """
+    first colliding step of many inputs, in closed form
+    At constant (v, omega), each step of motion moves the robot by the same
+    rigid motion: a rotation by omega*dt about a fixed centre, or a
+    translation by v*dt if omega is 0. Seen from the robot, each obstacle
+    then moves along a circle (or a line) in equal steps, and the robot
+    hits it at the first step that lands inside the footprint.
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        ob: obstacle positions
+            [[x(m), y(m)], ...]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        dt: time interval (s)
+        n_steps: number of steps to check
+        footprint: (half_length(m), half_width(m), radius(m))
+        ob_index: ObstacleIndex of ob, optional. With it, only the obstacles
+            within reach of the arcs are considered.
+    Returns:
+        first: index of the first colliding step of each input (0 for the
+            first step), n_steps if there is none
+    """
+    first = np.full(len(v), n_steps)
+    if len(v) == 0:
+        return first
+    if ob_index is not None:
+        # a turning robot stays within twice its turning radius of x
+        step = np.abs(np.asarray(v, dtype=float) * dt)
+        half = np.abs(np.asarray(omega, dtype=float) * dt) / 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            extent = np.minimum(n_steps * step,
+                                np.where(half > 0, step / np.sin(half), np.inf))
+        ob = ob_index.query_ball(x[:2], extent.max()
+                                 + math.hypot(footprint[0], footprint[1])
+                                 + footprint[2])
+    if len(ob) == 0:
+        return first
+
+    # obstacles in the robot frame at x
+    ob = np.asarray(ob, dtype=float)
+    cos_yaw, sin_yaw = math.cos(x[2]), math.sin(x[2])
+    dx, dy = ob[:, 0] - x[0], ob[:, 1] - x[1]
+    qx = cos_yaw * dx + sin_yaw * dy
+    qy = -sin_yaw * dx + cos_yaw * dy
+
+    step = np.asarray(v, dtype=float) * dt
+    delta = np.asarray(omega, dtype=float) * dt
+    # below this turn per step, the arcs bend by less than the rounding
+    # error of the poses over n_steps and are treated as straight lines
+    straight = np.abs(delta) * n_steps ** 2 < 1e-14
+    for samples, first_contact in (
+            (np.flatnonzero(straight), first_contact_on_lines),
+            (np.flatnonzero(~straight), first_contact_on_circles)):
+        if len(samples) > 0:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                first[samples] = first_contact(
+                    qx, qy, step[samples], delta[samples], n_steps, footprint)
+    return first
+
+
+def first_contact_from_cache(x, v, omega, dt, n_steps, footprint, ob_index,
+                             contact_cache, n_groups=4):
+    """
+    first_contact_on_arcs, reusing the contact obstacles of the last tick
+    The first contact with the cached obstacles is an upper bound of the
+    first contact of each input. Any obstacle hit no later than that is
+    within the distance travelled up to the bound, so only the obstacles
+    that close to x are searched, in groups of inputs with similar bounds.
+    The result is the same as first_contact_on_arcs.
+    Parameters:
+        x: current state
+            [x(m), y(m), yaw(rad), v(m/s), omega(rad/s)]
+        v: translational velocities (m/s), shape (n,)
+        omega: angular velocities (rad/s), shape (n,)
+        dt: time interval (s)
+        n_steps: number of steps to check
+        footprint: (half_length(m), half_width(m), radius(m))
+        ob_index: ObstacleIndex of the obstacles
+        contact_cache: ContactCache, updated with the contacts found
+        n_groups: number of groups of inputs searched together, at most
+            one per 64 inputs
+    Returns:
+        first: index of the first colliding step of each input (0 for the
+            first step), n_steps if there is none
+    """
+    v = np.asarray(v, dtype=float)
+    omega = np.asarray(omega, dtype=float)
+    reach = math.hypot(footprint[0], footprint[1]) + footprint[2]
+    bound = first_contact_on_arcs(x, contact_cache.get_contacts(ob_index, x),
+                                  v, omega, dt, n_steps, footprint)
+
+    # the poses up to step index k are within (k + 1) steps of x, and
+    # within twice the turning radius of x
+    step = np.abs(v * dt)
+    half = np.abs(omega * dt) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        extent = np.minimum(np.minimum(bound + 1, n_steps) * step,
+                            np.where(half > 0, step / np.sin(half), np.inf))
+    first = bound.copy()
+    n_groups = min(n_groups, max(1, len(v) // 64))
+    for group in np.array_split(np.argsort(extent), n_groups):
+        if len(group) == 0:
+            continue
+        near = ob_index.query_ball(x[:2], extent[group].max() + reach)
+        first[group] = np.minimum(first[group], first_contact_on_arcs(
+            x, near, v[group], omega[group], dt, n_steps, footprint))
+
+    # obstacles touched at the first contact of each input
+    collided = first < n_steps
+    px, py, _ = calc_poses(x, v[collided], omega[collided] * dt, dt,
+                           first[collided] + 1)
+    _, touched = ob_index.query_pairs(np.stack((px, py), axis=1),
+                                      reach + 1e-6)
+    contact_cache.update(ob_index, ob_index.ob[np.unique(touched)], x)
+    return first
+
+
+def first_contact_on_lines(qx, qy, step, delta, n_steps, footprint):
+    # the robot moves step along its x axis each step (delta is ~0)
+    half_length, half_width, radius = footprint
+    first = np.full(len(step), n_steps)
+    # lateral overlap of each obstacle with the footprint
+    ay = np.abs(qy) - half_width
+    near = ay <= radius
+    ex = np.sqrt(radius ** 2 - np.maximum(ay[near], 0) ** 2)
+    s_min = qx[near] - half_length - ex
+    s_max = qx[near] + half_length + ex
+    if len(s_min) == 0:
+        return first
+
+    # travelled distance k * step must lie in [s_min, s_max], k >= 1;
+    # backwards steps mirror the interval
+    backwards = step[:, None] < 0
+    step = np.abs(step)[:, None]
+    s_min, s_max = (np.where(backwards, -s_max, s_min),
+                    np.where(backwards, -s_min, s_max))
+    k = np.where(step > 0, np.maximum(1, np.ceil(s_min / step)), 1)
+    hit = (k * step <= s_max) & (k <= n_steps) & ((step > 0) | (s_min <= 0))
+    k = np.where(hit, k, n_steps + 1).min(axis=1)
+    return (k - 1).astype(int)
+
+
+def first_contact_on_circles(qx, qy, step, delta, n_steps, footprint):
+    # the robot turns by delta about a centre (cx, cy) each step
+    half_length, half_width, radius = footprint
+    first = np.full(len(step), n_steps)
+    half = delta / 2
+    rho = step / (2 * np.sin(half))  # signed turning radius
+    cx, cy = -step / 2, rho * np.cos(half)
+    # the point at angle u about the centre is at
+    # (cx + sign * d * sin(u), cy - sign * d * cos(u)), so that u is about
+    # 0 near the robot. Near straight arcs have their centre far away, and
+    # the terms below are kept free of cancellations at that distance.
+    sign = np.where(rho < 0, -1.0, 1.0)
+    # |rho| * (1 - cos(half)), the height of the robot above the point at
+    # u = 0 of its own circle
+    rise = np.abs(step * np.tan(half / 2)) / 2
+
+    # keep the (input, obstacle) pairs whose circle about the centre
+    # passes within reach of the robot, comparing the circle radius d with
+    # the distance of the robot from the centre (|rho|) in a stable form
+    reach = math.hypot(half_length, half_width) + radius
+    d = np.hypot(qx[None, :] - cx[:, None], qy[None, :] - cy[:, None])
+    gap = ((qx ** 2 + qy ** 2)[None, :]
+           - 2 * (qx[None, :] * cx[:, None] + qy[None, :] * cy[:, None])
+           ) / (d + np.abs(rho)[:, None])
+    # gap is nan for an obstacle on the centre of a turn in place
+    sample, obstacle = np.nonzero(~(np.abs(gap) > reach))
+    if len(sample) == 0:
+        return first
+    cx, cy, sign = cx[sample], cy[sample], sign[sample]
+    d, gap = d[sample, obstacle], gap[sample, obstacle]
+    qx, qy = qx[obstacle], qy[obstacle]
+    beta = np.arctan2(sign * (qx - cx), sign * (cy - qy))
+    # d - sign * cy, the height of the robot above the point at u = 0 of
+    # the obstacle circle
+    lift = gap + rise[sample]
+
+    # angles where the obstacle circle crosses the footprint boundary:
+    # the corner circles, and the straight sides for a box
+    corners = [(half_length, half_width)]
+    if half_length > 0 or half_width > 0:
+        corners += [(-half_length, half_width), (half_length, -half_width),
+                    (-half_length, -half_width)]
+    angles = []
+    for px, py in corners:
+        e = np.hypot(px - cx, py - cy)
+        # (d - e) ** 2 + 4 * d * e * sin(a / 2) ** 2 = radius ** 2
+        d_e = (qx ** 2 + qy ** 2 - px ** 2 - py ** 2
+               - 2 * (cx * (qx - px) + cy * (qy - py))) / (d + e)
+        w = (radius ** 2 - d_e ** 2) / (4 * d * e)
+        a = 2 * np.arcsin(np.sqrt(np.where((w >= 0) & (w <= 1), w, np.nan)))
+        g = np.arctan2(sign * (px - cx), sign * (cy - py))
+        angles += [g + a, g - a]
+    if len(corners) > 1:
+        for side in (half_length + radius, -half_length - radius):
+            s = sign * (side - cx) / d
+            a = np.arcsin(np.where(np.abs(s) <= 1, s, np.nan))
+            angles += [a, math.pi - a]
+        for side in (half_width + radius, -half_width - radius):
+            # 1 - cos(u) at the crossings
+            c = (lift + sign * side) / d
+            a = 2 * np.arcsin(np.sqrt(np.where((c >= 0) & (c <= 2),
+                                               c / 2, np.nan)))
+            angles += [a, -a]
+    # wrap to [-pi, pi], leaving the angles near the robot untouched
+    angles = np.stack(angles, axis=1)
+    angles = np.sort(angles - 2 * math.pi * np.round(angles / (2 * math.pi)),
+                     axis=1)
+    n_angles = np.count_nonzero(~np.isnan(angles), axis=1)
+
+    # arcs between consecutive crossings, the last one wrapping around;
+    # a circle with no crossing is one arc all the way around
+    lo = angles
+    hi = np.roll(angles, -1, axis=1)
+    last = np.maximum(n_angles - 1, 0)
+    rows = np.arange(len(lo))
+    hi[rows, last] = np.where(n_angles > 0, angles[:, 0], 0) + 2 * math.pi
+    lo[rows[n_angles == 0], 0] = 0
+    valid = np.arange(lo.shape[1])[None, :] < np.maximum(n_angles, 1)[:, None]
+    mid = (lo + hi) / 2
+    mx = cx[:, None] + (sign * d)[:, None] * np.sin(mid)
+    my = sign[:, None] * (2 * d[:, None] * np.sin(mid / 2) ** 2
+                          - lift[:, None])
+    bx = np.maximum(np.abs(mx) - half_length, 0)
+    by = np.maximum(np.abs(my) - half_width, 0)
+    inside = valid & (np.sqrt(bx ** 2 + by ** 2) <= radius)
+    arc, column = np.nonzero(inside)
+    if len(arc) == 0:
+        return first
+
+    # at step k the obstacle is at angle beta - k * delta about the centre
+    lo, hi = lo[arc, column], hi[arc, column]
+    beta, turn = beta[arc], delta[sample[arc]]
+    lo, hi = (np.where(turn > 0, beta - hi, lo - beta),
+              np.where(turn > 0, beta - lo, hi - beta))
+    k = first_step_in_intervals(lo, hi, np.abs(turn), n_steps)
+    np.minimum.at(first, sample[arc], k - 1)
+    return first
+
+
+def first_step_in_intervals(lo, hi, turn, n_steps):
+    """
+    smallest k in [1, n_steps] with k * turn in [lo, hi] modulo 2 pi,
+    n_steps + 1 if there is none
+    """
+    # turns of 2 pi added to the interval, starting from the one below 0;
+    # an interval already there is kept exact
+    turns = -np.floor(lo / (2 * math.pi)) - 1
+    k = np.full(len(lo), n_steps + 1)
+    todo = np.arange(len(lo))
+    while len(todo) > 0:
+        lo_m = lo[todo] + 2 * math.pi * turns[todo]
+        hi_m = hi[todo] + 2 * math.pi * turns[todo]
+        k_m = np.maximum(1, np.ceil(lo_m / turn[todo]))
+        hit = (k_m * turn[todo] <= hi_m) & (k_m <= n_steps)
+        k[todo[hit]] = k_m[hit]
+        # stop once the interval starts beyond the last step
+        todo = todo[~hit & (lo_m <= n_steps * turn[todo])]
+        turns[todo] += 1
+    return k
+
+
+def calc_to_goal_costs(trajectories, goal):
+    """
+    calc_to_goal_cost of many trajectories at once
+    Parameters:
+        trajectories: predicted trajectories
+            [[[x, y, yaw, v, omega], ...], ...]
+        goal: goal position
+            [x(m), y(m)]
+    Returns:
+        to goal costs, shape (n,)
+    """
+
+    dx = goal[0] - trajectories[:, -1, 0]
+    dy = goal[1] - trajectories[:, -1, 1]
+    error_angle = np.arctan2(dy, dx)
+    cost_angle = error_angle - trajectories[:, -1, 2]
+    cost = np.abs(np.arctan2(np.sin(cost_angle), np.cos(cost_angle)))
+
+    return cost
+
+
 def calc_to_goal_cost(trajectory, goal):
     """
     calc to goal cost with angle difference
@@ -350,8 +2073,24 @@ def dwa(x, goal, ob, config):
         fig_path = os.path.join(fig_dir, 'frame_{}.png'.format(i_fig))
 
     trajectory = np.array(x)
+    ob_index = calc_obstacle_index(ob, config)
+    # the swept collision check works on the lattice of the primitives
+    if config.motion_primitives or config.collision_check == "swept":
+        primitives = MotionPrimitives(config)
+    else:
+        primitives = None
+    contact_cache = ContactCache()
+    if config.n_workers > 1:
+        pool = ObstacleSearchPool(ob, config, config.n_workers)
+    else:
+        pool = None
+    coverage = WindowCoverage()
+    coverage_list = []
     while True:
-        u, predicted_trajectory = dwa_control(x, config, goal, ob)
+        u, predicted_trajectory = dwa_control(x, config, goal, ob, ob_index,
+                                              primitives, contact_cache, pool,
+                                              coverage)
+        coverage_list.append(coverage.fraction)
         x = motion(x, u, config.dt)  # simulate robot
         trajectory = np.vstack((trajectory, x))  # store state history
 
@@ -382,6 +2121,11 @@ def dwa(x, goal, ob, config):
             print("Goal!!")
             break
 
+    if pool is not None:
+        pool.close()
+    if config.control_time_budget > 0:
+        print("Window coverage: min {:.0%}, mean {:.0%}".format(
+            min(coverage_list), np.mean(coverage_list)))
     print("Done")
     if show_animation:
         plt.plot(trajectory[:, 0], trajectory[:, 1], "-r")
@@ -0,0 +1,430 @@
+"""
+
+Hierarchical path-finding A* (HPA*) grid planning
+
+The grid of the A* grid planner is split into square clusters. Entrances
+between neighbouring clusters and the shortest path costs between the
+entrances of each cluster are computed once per map. A query then only
+searches inside the start and goal clusters and over the small abstract
+graph of entrances. The result is refined into grid cells by a search
+over the clusters the abstract path passes through, where the path may
+cross the cluster borders anywhere and not only at the entrances.
+
+The paths are near optimal, not optimal: they are the shortest paths
+within that corridor of clusters. If the abstract graph finds no route
+(e.g. two clusters are only connected through a diagonal move across a
+cluster corner), planning falls back to a full A* search. Obstacle
+updates only rebuild the clusters whose cells changed and the entrances
+on their borders.
+
+See A. Botea, M. Mueller and J. Schaeffer, "Near Optimal Hierarchical
+Path-Finding", Journal of Game Development, 2004.
+
+"""
+
+import heapq
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from a_star import AStarPlanner
+
+show_animation = True
+
+
+class HPAStarPlanner(AStarPlanner):
+
+    def __init__(
+        self, ob, resolution, rr,
+        min_x=None, min_y=None, max_x=None, max_y=None, cluster_size=10
+    ):
+        """
+        Initialize grid map and abstract graph for hpa star planning
+
+        ob: obstacle positions [[x(m), y(m)], ...]
+        resolution: grid resolution [m]
+        rr: robot radius[m]
+        cluster_size: width of a cluster [grid cells]
+        """
+        super().__init__(ob, resolution, rr,
+                         min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y)
+        self.cluster_size = cluster_size
+        self.x_limit, self.y_limit = self.calc_index_limit()
+        self.cluster_graphs = None
+        self.cluster_nodes = None
+        self.entrances = None
+        self.abstract_edges = None
+        self.dirty_clusters = None
+        self.calc_abstract_graph()
+
+    def planning(self, sx, sy, gx, gy):
+        """
+        HPA star path search
+
+        input:
+            s_x: start x position [m]
+            s_y: start y position [m]
+            gx: goal x position [m]
+            gy: goal y position [m]
+
+        output:
+            rx: x position list of the final path
+            ry: y position list of the final path
+        """
+        start_x = self.calc_xy_index(sx, self.min_x)
+        start_y = self.calc_xy_index(sy, self.min_y)
+        goal_x = self.calc_xy_index(gx, self.min_x)
+        goal_y = self.calc_xy_index(gy, self.min_y)
+        if not self.is_inside(goal_x, goal_y):
+            print("Goal is outside the map..")
+            return [self.calc_grid_position(goal_x, self.min_x)], [
+                self.calc_grid_position(goal_y, self.min_y)]
+        if not self.is_inside(start_x, start_y):
+            # the A* search expands a start off the grid without indexing it
+            print("Start is outside the map, falling back to A*..")
+            return super().planning(sx, sy, gx, gy)
+        if self.dirty_clusters:
+            self.update_clusters(self.dirty_clusters)
+            self.dirty_clusters = set()
+
+        s_id = self.calc_grid_index(start_x, start_y)
+        g_id = self.calc_grid_index(goal_x, goal_y)
+        if self.obstacle_map[goal_x, goal_y] and s_id != g_id:
+            print("Open set is empty..")
+            return self.calc_final_path(g_id, None)
+
+        # connect start and goal to the entrances of their own clusters
+        s_cluster = self.calc_cluster(start_x, start_y)
+        g_cluster = self.calc_cluster(goal_x, goal_y)
+        start_targets = set(self.cluster_nodes[s_cluster])
+        if s_cluster == g_cluster:
+            start_targets.add(g_id)
+        start_edges = self.search_cluster(s_cluster, s_id, False,
+                                          start_targets)
+        goal_edges = dict(self.search_cluster(
+            g_cluster, g_id, True, self.cluster_nodes[g_cluster]))
+
+        # abstract search from start to goal
+        cost_so_far = {s_id: 0.0}
+        came_from = {s_id: None}
+        open_heap = [(self.calc_heuristic_id(s_id, g_id), 0, s_id)]
+        n_pushed = 1
+        closed = set()
+        while open_heap:
+            _, _, c_id = heapq.heappop(open_heap)
+            if c_id in closed:
+                continue
+            if c_id == g_id:
+                break
+            closed.add(c_id)
+
+            if show_animation:  # pragma: no cover
+                c_x, c_y = divmod(c_id, self.y_width)
+                plt.plot(self.calc_grid_position(c_x, self.min_x),
+                         self.calc_grid_position(c_y, self.min_y), "xc")
+
+            edges = list(self.abstract_edges.get(c_id, []))
+            if c_id == s_id:
+                edges += start_edges
+            if c_id in goal_edges:
+                edges.append((g_id, goal_edges[c_id]))
+            for n_id, cost in edges:
+                cost += cost_so_far[c_id]
+                if n_id in closed or cost_so_far.get(n_id, np.inf) <= cost:
+                    continue
+                cost_so_far[n_id] = cost
+                came_from[n_id] = c_id
+                heapq.heappush(open_heap, (
+                    cost + self.calc_heuristic_id(n_id, g_id), n_pushed, n_id))
+                n_pushed += 1
+
+        if g_id not in came_from:
+            print("No abstract path, falling back to A*..")
+            return super().planning(sx, sy, gx, gy)
+        print("Find goal")
+
+        # refine: every abstract edge stays inside one cluster or crosses
+        # into a neighbouring one, so the clusters of the abstract nodes
+        # hold the whole abstract path. Searching them again lets the path
+        # cross the cluster borders anywhere, not only at the entrances.
+        corridor = set()
+        c_id = g_id
+        while c_id is not None:
+            corridor.add(self.calc_cluster(*divmod(c_id, self.y_width)))
+            c_id = came_from[c_id]
+        cells = self.search_corridor(corridor, s_id, g_id, cost_so_far[g_id])
+        if cells is None:
+            print("No corridor path, falling back to A*..")
+            return super().planning(sx, sy, gx, gy)
+
+        rx, ry = [], []
+        for cell in cells:
+            ix, iy = divmod(cell, self.y_width)
+            rx.append(self.calc_grid_position(ix, self.min_x))
+            ry.append(self.calc_grid_position(iy, self.min_y))
+
+        return rx, ry
+
+    def search_corridor(self, corridor, s_id, g_id, limit):
+        """
+        Shortest path from s_id to g_id through the cells of the corridor
+        clusters, searched no further than cost limit
+
+        Only the cells of the corridor are numbered, so the search grows
+        with the corridor and not with the map.
+
+        :return: cell ids from the goal back to the start, None if no path
+            is found within limit
+        """
+        # grid indices of the corridor cells, in increasing order
+        cells = np.sort(np.concatenate(
+            [self.calc_cluster_cells(cluster) for cluster in corridor]))
+        cx, cy = np.divmod(cells, self.y_width)
+        rows, cols, costs = [], [], []
+        for dx, dy, cost in self.motion:
+            nx, ny = cx + dx, cy + dy
+            inside = np.flatnonzero((0 <= nx) & (nx < self.x_limit)
+                                    & (0 <= ny) & (ny < self.y_limit))
+            n_id = self.calc_grid_index(nx[inside], ny[inside])
+            local = np.minimum(np.searchsorted(cells, n_id), len(cells) - 1)
+            # moves into free cells of the corridor only
+            ok = (cells[local] == n_id) & ~self.obstacle_map.flat[n_id]
+            rows.append(inside[ok])
+            cols.append(local[ok])
+            costs.append(np.full(np.count_nonzero(ok), cost))
+        n = len(cells)
+        graph = coo_matrix((np.concatenate(costs),
+                            (np.concatenate(rows), np.concatenate(cols))),
+                           shape=(n, n)).tocsr()
+
+        source = np.searchsorted(cells, s_id)
+        target = np.searchsorted(cells, g_id)
+        # limit only prunes: the abstract path itself lies in the corridor
+        dist, pred = dijkstra(graph, indices=source, return_predecessors=True,
+                              limit=limit + 1e-9)
+        if not np.isfinite(dist[target]):
+            return None
+
+        path = [target]
+        while path[-1] != source:
+            path.append(pred[path[-1]])
+        return cells[path].tolist()
+
+    def calc_cluster_cells(self, cluster):
+        # grid indices of the cells of a cluster
+        x0, y0, x1, y1 = self.calc_cluster_bounds(cluster)
+        ix, iy = np.meshgrid(np.arange(x0, x1), np.arange(y0, y1),
+                             indexing="ij")
+        return self.calc_grid_index(ix, iy).ravel()
+
+    def calc_abstract_graph(self):
+        """
+        Build the entrances between clusters and the shortest path costs
+        between the entrances of each cluster
+        """
+        cs = self.cluster_size
+        clusters = [(i, j) for i in range(-(-self.x_limit // cs))
+                    for j in range(-(-self.y_limit // cs))]
+        self.cluster_graphs = {}
+        self.cluster_nodes = {cluster: set() for cluster in clusters}
+        self.entrances = {}
+        self.abstract_edges = {}
+        self.dirty_clusters = set()
+        self.update_clusters(clusters)
+
+    def update_clusters(self, clusters):
+        """
+        Rebuild the entrances on the borders of clusters, and the abstract
+        edges of clusters and of their neighbours, whose entrances on the
+        shared borders may have moved
+        """
+        borders = set()
+        for cluster in clusters:
+            self.cluster_graphs.pop(cluster, None)
+            borders.update(self.calc_borders(cluster))
+        for border in borders:
+            self.entrances[border] = self.calc_entrances(*border)
+
+        for cluster in set(clusters).union(*borders):
+            for n_id in self.cluster_nodes[cluster]:
+                self.abstract_edges.pop(n_id, None)
+
+            # inter-cluster edges across the borders of the cluster
+            nodes = set()
+            for border in self.calc_borders(cluster):
+                side = border.index(cluster)
+                for pair in self.entrances[border]:
+                    nodes.add(pair[side])
+                    self.abstract_edges.setdefault(pair[side], []).append(
+                        (pair[1 - side], 1.0))
+            self.cluster_nodes[cluster] = nodes
+
+            # intra-cluster edges between the entrances of the cluster
+            for n_id in nodes:
+                self.abstract_edges[n_id] += self.search_cluster(
+                    cluster, n_id, False, nodes)
+
+    def calc_borders(self, cluster):
+        # (cluster_a, cluster_b) of each border, cluster_b right of or
+        # above cluster_a
+        i, j = cluster
+        cs = self.cluster_size
+        borders = []
+        if i > 0:
+            borders.append(((i - 1, j), cluster))
+        if (i + 1) * cs < self.x_limit:
+            borders.append((cluster, (i + 1, j)))
+        if j > 0:
+            borders.append(((i, j - 1), cluster))
+        if (j + 1) * cs < self.y_limit:
+            borders.append((cluster, (i, j + 1)))
+        return borders
+
+    def calc_entrances(self, cluster_a, cluster_b):
+        """
+        Transitions across the border between two neighbouring clusters
+
+        :return: [(cell id in cluster_a, cell id in cluster_b), ...]
+        """
+        x0, y0, x1, y1 = self.calc_cluster_bounds(cluster_a)
+        # facing cells (ax, ay, bx, by) along the shared border
+        if cluster_b[0] > cluster_a[0]:
+            pairs = [(x1 - 1, y, x1, y) for y in range(y0, y1)]
+        else:
+            pairs = [(x, y1 - 1, x, y1) for x in range(x0, x1)]
+
+        entrances = []
+        run = []
+        for pair in pairs + [None]:
+            if pair is not None and not (
+                    self.obstacle_map[pair[0], pair[1]]
+                    or self.obstacle_map[pair[2], pair[3]]):
+                run.append(pair)
+                continue
+            if not run:
+                continue
+            # one transition in the middle of a short run, one at each end
+            # of a long one
+            ends = [run[0], run[-1]] if len(run) >= 6 else [run[len(run) // 2]]
+            for ax, ay, bx, by in ends:
+                entrances.append((self.calc_grid_index(ax, ay),
+                                  self.calc_grid_index(bx, by)))
+            run = []
+        return entrances
+
+    def search_cluster(self, cluster, source_id, to_source, targets):
+        """
+        Shortest path costs inside a cluster from source_id to each of the
+        target cells of the cluster (or from each of them to source_id if
+        to_source)
+
+        :return: [(cell id, cost), ...] of the reachable targets other than
+            source_id
+        """
+        x0, y0, _, y1 = self.calc_cluster_bounds(cluster)
+        graph = self.cluster_graphs.get(cluster)
+        if graph is None:
+            graph = self.calc_cluster_graph(cluster)
+            self.cluster_graphs[cluster] = graph
+        height = y1 - y0
+        sx, sy = divmod(source_id, self.y_width)
+        source = (sx - x0) * height + (sy - y0)
+
+        dist = dijkstra(graph.T if to_source else graph, indices=source)
+
+        targets = [n_id for n_id in targets if n_id != source_id]
+        tx, ty = np.divmod(np.asarray(targets, dtype=int), self.y_width)
+        target_dist = dist[(tx - x0) * height + (ty - y0)]
+        return [(n_id, float(d)) for n_id, d in zip(targets, target_dist)
+                if np.isfinite(d)]
+
+    def calc_cluster_graph(self, cluster):
+        # directed moves inside the cluster, into free cells only
+        x0, y0, x1, y1 = self.calc_cluster_bounds(cluster)
+        width, height = x1 - x0, y1 - y0
+        lx, ly = np.meshgrid(np.arange(width), np.arange(height),
+                             indexing="ij")
+        lx, ly = lx.ravel(), ly.ravel()
+        rows, cols, costs = [], [], []
+        for dx, dy, cost in self.motion:
+            nx, ny = lx + dx, ly + dy
+            ok = (0 <= nx) & (nx < width) & (0 <= ny) & (ny < height)
+            ok[ok] = ~self.obstacle_map[x0 + nx[ok], y0 + ny[ok]]
+            rows.append(lx[ok] * height + ly[ok])
+            cols.append(nx[ok] * height + ny[ok])
+            costs.append(np.full(np.count_nonzero(ok), cost))
+        n = width * height
+        return coo_matrix((np.concatenate(costs),
+                           (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(n, n)).tocsr()
+
+    def calc_cluster(self, ix, iy):
+        return ix // self.cluster_size, iy // self.cluster_size
+
+    def calc_cluster_bounds(self, cluster):
+        cs = self.cluster_size
+        x0, y0 = cluster[0] * cs, cluster[1] * cs
+        return x0, y0, min(x0 + cs, self.x_limit), min(y0 + cs, self.y_limit)
+
+    def calc_heuristic_id(self, id1, id2):
+        x1, y1 = divmod(id1, self.y_width)
+        x2, y2 = divmod(id2, self.y_width)
+        return self.calc_heuristic(x1, y1, x2, y2)
+
+    def update_obstacle_count(self, indices, delta):
+        before = self.obstacle_map.reshape(-1)[indices]
+        super().update_obstacle_count(indices, delta)
+        after = self.obstacle_map.reshape(-1)[indices]
+        # clusters of the cells whose occupancy flipped, rebuilt at the next
+        # planning call
+        ix, iy = np.divmod(np.unique(indices[before != after]), self.y_width)
+        inside = (ix < self.x_limit) & (iy < self.y_limit)
+        self.dirty_clusters.update(zip(
+            (ix[inside] // self.cluster_size).tolist(),
+            (iy[inside] // self.cluster_size).tolist()))
+
+
+def main():
+    print(__file__ + " start!!")
+
+    # start and goal position
+    sx = 10.0  # [m]
+    sy = 10.0  # [m]
+    gx = 50.0  # [m]
+    gy = 50.0  # [m]
+    grid_size = 1.0  # [m]
+    robot_radius = 1.0  # [m]
+
+    ox, oy = [], []
+    for i in range(-10, 40):
+        ox.append(20.0)
+        oy.append(i)
+    for i in range(0, 40):
+        ox.append(40.0)
+        oy.append(60.0 - i)
+    ob = np.array([ox, oy]).transpose()
+
+    if show_animation:  # pragma: no cover
+        plt.plot(ox, oy, ".k")
+        plt.plot(sx, sy, "og")
+        plt.plot(gx, gy, "xb")
+        plt.grid(True)
+        plt.axis("equal")
+
+    hpa_star = HPAStarPlanner(
+        ob, grid_size, robot_radius,
+        min_x=min(*ox, sx-2, gx-2), min_y=min(*oy, sy-2, gy-2),
+        max_x=max(*ox, sx+2, gx+2), max_y=max(*oy, sy+2, gy+2)
+    )
+    rx, ry = hpa_star.planning(sx, sy, gx, gy)
+
+    if show_animation:  # pragma: no cover
+        plt.plot(rx, ry, "-r")
+        plt.pause(0.001)
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
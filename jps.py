@@ -0,0 +1,281 @@
+"""
+
+Jump Point Search grid planning
+
+Same grid and motion model as the A* grid planner, but only jump points
+are pushed to the open set: straight and diagonal runs across open space
+are skipped in one step, so far fewer nodes are expanded on open maps.
+The returned path is expanded back to every grid cell it passes through,
+like the output of AStarPlanner.planning.
+
+See D. Harabor and A. Grastien, "Online Graph Pruning for Pathfinding on
+Grid Maps", AAAI 2011.
+
+"""
+
+import heapq
+import math
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from a_star import AStarPlanner
+
+show_animation = True
+
+
+class JPSPlanner(AStarPlanner):
+
+    def __init__(
+        self, ob, resolution, rr,
+        min_x=None, min_y=None, max_x=None, max_y=None
+    ):
+        """
+        Initialize grid map for jump point search planning
+
+        ob: obstacle positions [[x(m), y(m)], ...]
+        resolution: grid resolution [m]
+        rr: robot radius[m]
+        """
+        super().__init__(ob, resolution, rr,
+                         min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y)
+        self.x_limit, self.y_limit = self.calc_index_limit()
+        self.n_expanded = 0
+
+    def planning(self, sx, sy, gx, gy):
+        """
+        Jump point search
+
+        input:
+            s_x: start x position [m]
+            s_y: start y position [m]
+            gx: goal x position [m]
+            gy: goal y position [m]
+
+        output:
+            rx: x position list of the final path
+            ry: y position list of the final path
+        """
+
+        start_x = self.calc_xy_index(sx, self.min_x)
+        start_y = self.calc_xy_index(sy, self.min_y)
+        goal_x = self.calc_xy_index(gx, self.min_x)
+        goal_y = self.calc_xy_index(gy, self.min_y)
+        goal_id = self.calc_grid_index(goal_x, goal_y)
+        if not self.is_inside(goal_x, goal_y):
+            print("Goal is outside the map..")
+            return [self.calc_grid_position(goal_x, self.min_x)], [
+                self.calc_grid_position(goal_y, self.min_y)]
+        if not self.is_inside(start_x, start_y):
+            # the A* search expands a start off the grid without indexing it
+            print("Start is outside the map, falling back to A*..")
+            return super().planning(sx, sy, gx, gy)
+
+        n_cells = self.x_width * self.y_width
+        g_cost = np.full(n_cells, np.inf)
+        f_cost = np.full(n_cells, np.inf)
+        parent = np.full(n_cells, -1, dtype=np.int32)
+        closed = np.zeros(n_cells, dtype=bool)
+
+        s_id = self.calc_grid_index(start_x, start_y)
+        g_cost[s_id] = 0.0
+        f_cost[s_id] = self.calc_heuristic(goal_x, goal_y, start_x, start_y)
+        n_pushed = 1
+        open_heap = [(f_cost[s_id], 0, s_id)]
+        self.n_expanded = 0
+
+        found = False
+        while open_heap:
+            f, _, c_id = heapq.heappop(open_heap)
+            if closed[c_id] or f > f_cost[c_id]:
+                continue
+            c_x, c_y = divmod(c_id, self.y_width)
+
+            # show graph
+            if show_animation:  # pragma: no cover
+                plt.plot(self.calc_grid_position(c_x, self.min_x),
+                         self.calc_grid_position(c_y, self.min_y), "xc")
+                if self.n_expanded % 10 == 0:
+                    plt.pause(0.001)
+
+            if c_id == goal_id:
+                print("Find goal")
+                found = True
+                break
+
+            closed[c_id] = True
+            self.n_expanded += 1
+
+            if parent[c_id] == -1:
+                p_x, p_y = c_x, c_y
+            else:
+                p_x, p_y = divmod(int(parent[c_id]), self.y_width)
+            for dx, dy in self.prune_directions(
+                    c_x, c_y, np.sign(c_x - p_x), np.sign(c_y - p_y)):
+                jump_point = self.jump(c_x, c_y, dx, dy, goal_x, goal_y)
+                if jump_point is None:
+                    continue
+                n_x, n_y = jump_point
+                n_id = self.calc_grid_index(n_x, n_y)
+                if closed[n_id]:
+                    continue
+
+                cost = g_cost[c_id] + self.calc_octile_distance(
+                    n_x - c_x, n_y - c_y)
+                if g_cost[n_id] <= cost:
+                    continue
+                g_cost[n_id] = cost
+                parent[n_id] = c_id
+                f_cost[n_id] = cost + self.calc_heuristic(
+                    goal_x, goal_y, n_x, n_y)
+                heapq.heappush(open_heap, (f_cost[n_id], n_pushed, n_id))
+                n_pushed += 1
+        else:
+            print("Open set is empty..")
+
+        if not found:
+            return self.calc_final_path(goal_id, None)
+
+        return self.calc_final_path(goal_id, parent)
+
+    def calc_final_path(self, goal_id, parent):
+        # generate final course, filling in the cells between jump points
+        rx, ry = [], []
+        index = goal_id
+        while index != -1:
+            ix, iy = divmod(index, self.y_width)
+            next_index = -1 if parent is None else int(parent[index])
+            if next_index == -1:
+                n_x, n_y = ix, iy
+            else:
+                n_x, n_y = divmod(next_index, self.y_width)
+            dx, dy = np.sign(n_x - ix), np.sign(n_y - iy)
+            while True:
+                rx.append(self.calc_grid_position(ix, self.min_x))
+                ry.append(self.calc_grid_position(iy, self.min_y))
+                if (ix, iy) == (n_x, n_y):
+                    break
+                ix, iy = ix + dx, iy + dy
+                if (ix, iy) == (n_x, n_y):
+                    break
+            index = next_index
+
+        return rx, ry
+
+    def prune_directions(self, x, y, dx, dy):
+        """
+        Directions worth searching from (x, y) when it was reached moving
+        along (dx, dy): the natural neighbours plus the forced ones
+        """
+        if dx == 0 and dy == 0:
+            return [(m[0], m[1]) for m in self.motion]
+
+        directions = []
+        if dx != 0 and dy != 0:
+            directions += [(dx, 0), (0, dy), (dx, dy)]
+            if not self.is_free(x - dx, y):
+                directions.append((-dx, dy))
+            if not self.is_free(x, y - dy):
+                directions.append((dx, -dy))
+        elif dx != 0:
+            directions.append((dx, 0))
+            for side in (1, -1):
+                if not self.is_free(x, y + side):
+                    directions.append((dx, side))
+        else:
+            directions.append((0, dy))
+            for side in (1, -1):
+                if not self.is_free(x + side, y):
+                    directions.append((side, dy))
+
+        return directions
+
+    def jump(self, x, y, dx, dy, goal_x, goal_y):
+        """
+        Move from (x, y) along (dx, dy) until a jump point is found
+
+        :return: (x, y) index of the jump point, None if the run is blocked
+        """
+        while True:
+            x, y = x + dx, y + dy
+            if not self.is_free(x, y):
+                return None
+            if x == goal_x and y == goal_y:
+                return x, y
+
+            if dx != 0 and dy != 0:
+                if ((not self.is_free(x - dx, y)
+                     and self.is_free(x - dx, y + dy))
+                        or (not self.is_free(x, y - dy)
+                            and self.is_free(x + dx, y - dy))):
+                    return x, y
+                # a diagonal step is a jump point if a straight run from it
+                # reaches one
+                if (self.jump(x, y, dx, 0, goal_x, goal_y) is not None
+                        or self.jump(x, y, 0, dy, goal_x, goal_y) is not None):
+                    return x, y
+            elif dx != 0:
+                if ((not self.is_free(x, y + 1) and self.is_free(x + dx, y + 1))
+                        or (not self.is_free(x, y - 1)
+                            and self.is_free(x + dx, y - 1))):
+                    return x, y
+            else:
+                if ((not self.is_free(x + 1, y) and self.is_free(x + 1, y + dy))
+                        or (not self.is_free(x - 1, y)
+                            and self.is_free(x - 1, y + dy))):
+                    return x, y
+
+    def is_free(self, ix, iy):
+        if not (0 <= ix < self.x_limit and 0 <= iy < self.y_limit):
+            return False
+        return not self.obstacle_map[ix, iy]
+
+    @staticmethod
+    def calc_octile_distance(dx, dy):
+        dx, dy = abs(dx), abs(dy)
+        return math.sqrt(2) * min(dx, dy) + abs(dx - dy)
+
+
+def main():
+    print(__file__ + " start!!")
+
+    # start and goal position
+    sx = 10.0  # [m]
+    sy = 10.0  # [m]
+    gx = 50.0  # [m]
+    gy = 50.0  # [m]
+    grid_size = 2.0  # [m]
+    robot_radius = 1.0  # [m]
+
+    ox, oy = [], []
+    for i in range(-10, 40):
+        ox.append(20.0)
+        oy.append(i)
+    for i in range(0, 40):
+        ox.append(40.0)
+        oy.append(60.0 - i)
+    ob = np.array([ox, oy]).transpose()
+
+    if show_animation:  # pragma: no cover
+        plt.plot(ox, oy, ".k")
+        plt.plot(sx, sy, "og")
+        plt.plot(gx, gy, "xb")
+        plt.grid(True)
+        plt.axis("equal")
+
+    jps = JPSPlanner(
+        ob, grid_size, robot_radius,
+        min_x=min(*ox, sx-2, gx-2), min_y=min(*oy, sy-2, gy-2),
+        max_x=max(*ox, sx+2, gx+2), max_y=max(*oy, sy+2, gy+2)
+    )
+    rx, ry = jps.planning(sx, sy, gx, gy)
+    print("expanded:", jps.n_expanded)
+
+    if show_animation:  # pragma: no cover
+        plt.plot(rx, ry, "-r")
+        plt.pause(0.001)
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import contextlib
+import io
+import math
+
+import numpy as np
+
+import a_star
+from test_hpa_star import make_map
+
+a_star.show_animation = False
+
+
+def make_planner(ob, resolution=1.0, rr=1.0, **bounds):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return a_star.AStarPlanner(ob, resolution, rr, **bounds)
+
+
+def plan(planner, sx, sy, gx, gy):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return planner.planning(sx, sy, gx, gy)
+
+
+def reference_planning(planner, sx, sy, gx, gy):
+    # the dict-based search of the original planner: the open node of
+    # least f cost, the first one inserted among ties, is expanded next
+    def calc_grid_index(x, y):
+        return (y - planner.min_y) * planner.x_width + (x - planner.min_x)
+
+    def calc_position(x, y):
+        return (planner.calc_grid_position(x, planner.min_x),
+                planner.calc_grid_position(y, planner.min_y))
+
+    start = (planner.calc_xy_index(sx, planner.min_x),
+             planner.calc_xy_index(sy, planner.min_y))
+    goal = (planner.calc_xy_index(gx, planner.min_x),
+            planner.calc_xy_index(gy, planner.min_y))
+    # id: (x, y, cost, parent id)
+    open_set = {calc_grid_index(*start): start + (0.0, -1)}
+    closed_set = {}
+    goal_parent = -1
+    while open_set:
+        c_id = min(open_set, key=lambda o: open_set[o][2] + math.hypot(
+            goal[0] - open_set[o][0], goal[1] - open_set[o][1]))
+        x, y, cost, parent = open_set.pop(c_id)
+        if (x, y) == goal:
+            goal_parent = parent
+            break
+        closed_set[c_id] = (x, y, cost, parent)
+        for dx, dy, step in planner.motion:
+            px, py = calc_position(x + dx, y + dy)
+            if not (planner.min_x <= px < planner.max_x
+                    and planner.min_y <= py < planner.max_y):
+                continue
+            if planner.obstacle_map[x + dx][y + dy]:
+                continue
+            n_id = calc_grid_index(x + dx, y + dy)
+            if n_id in closed_set:
+                continue
+            if n_id not in open_set or open_set[n_id][2] > cost + step:
+                open_set[n_id] = (x + dx, y + dy, cost + step, c_id)
+
+    rx, ry = [calc_position(*goal)[0]], [calc_position(*goal)[1]]
+    while goal_parent != -1:
+        x, y, _, goal_parent = closed_set[goal_parent]
+        rx.append(calc_position(x, y)[0])
+        ry.append(calc_position(x, y)[1])
+    return rx, ry
+
+
+def test_paths_match_reference_search():
+    rng = np.random.default_rng(2)
+    for seed in range(6):
+        ob = make_map(seed)
+        for resolution, rr in ((1.0, 1.0), (2.0, 1.5)):
+            planner = make_planner(ob, resolution, rr)
+            for _ in range(8):
+                sx, sy, gx, gy = rng.uniform(1, 59, 4)
+                try:
+                    expected = reference_planning(planner, sx, sy, gx, gy)
+                except IndexError:
+                    continue  # the original search ran off its map
+                assert plan(planner, sx, sy, gx, gy) == expected
+
+
+def test_obstacle_map_matches_reference_loop():
+    rng = np.random.default_rng(3)
+    for seed in range(3):
+        # obstacles between the grid points too
+        ob = np.concatenate((make_map(seed), rng.uniform(0, 60, (40, 2))))
+        for resolution, rr in ((1.0, 1.0), (2.0, 1.5), (0.5, 0.75)):
+            planner = make_planner(ob, resolution, rr)
+            assert (planner.min_x, planner.min_y) == (round(ob[:, 0].min()),
+                                                      round(ob[:, 1].min()))
+            assert (planner.max_x, planner.max_y) == (round(ob[:, 0].max()),
+                                                      round(ob[:, 1].max()))
+            assert planner.x_width == round(
+                (planner.max_x - planner.min_x) / resolution)
+            assert planner.y_width == round(
+                (planner.max_y - planner.min_y) / resolution)
+
+            # every obstacle against every grid point, a column at a time
+            y = planner.calc_grid_position(np.arange(planner.y_width),
+                                           planner.min_y)
+            for ix in range(planner.x_width):
+                x = planner.calc_grid_position(ix, planner.min_x)
+                d = np.hypot(ob[None, :, 0] - x, ob[None, :, 1] - y[:, None])
+                assert np.array_equal(planner.obstacle_map[ix],
+                                      np.any(d <= rr, axis=1))
+
+
+def test_edge_queries_match_reference_search():
+    rng = np.random.default_rng(4)
+    ob = make_map(0)
+    for resolution in (1.0, 2.0):
+        # free cells around the border walls, and cells off the grid
+        planner = make_planner(ob, resolution, 1.0, min_x=-4, min_y=-4,
+                               max_x=65, max_y=65)
+        for q in range(30):
+            sx, sy = rng.uniform(-6, 67, 2)
+            gx, gy = rng.uniform(-5, 66, 2)
+            if q % 2:
+                # from the first cell off the grid edge to the ring of
+                # free cells between the edge and the walls, along x or y
+                sx = -4 - resolution * rng.uniform(0.6, 1.4)
+                sy = rng.uniform(-4, 60)
+                gx, gy = -3.0, rng.uniform(-4, 60)
+                if q % 4 == 1:
+                    sx, sy, gx, gy = sy, sx, gy, gx
+            try:
+                expected = reference_planning(planner, sx, sy, gx, gy)
+            except IndexError:
+                continue  # the original search ran off its map
+            assert plan(planner, sx, sy, gx, gy) == expected
+
+
+def test_obstacle_updates_match_rebuild():
+    rng = np.random.default_rng(5)
+    bounds = dict(min_x=0, min_y=0, max_x=60, max_y=60)
+    planner = make_planner(make_map(1), 1.0, 1.5, **bounds)
+    for step in range(8):
+        # cached paths must not outlive the map they were planned on
+        sx, sy, gx, gy = rng.uniform(2, 58, 4)
+        plan(planner, sx, sy, gx, gy)
+
+        points = rng.uniform(2, 58, (6, 2))
+        points[::2] = points[::2].round()
+        planner.add_obstacles(points)
+        if step % 2:
+            planner.remove_obstacles(points[1::2])
+        rebuilt = make_planner(planner.ob, 1.0, 1.5, **bounds)
+        assert np.array_equal(planner.obstacle_map, rebuilt.obstacle_map)
+        assert plan(planner, sx, sy, gx, gy) == plan(rebuilt, sx, sy, gx, gy)
@@ -0,0 +1,60 @@
+import contextlib
+import io
+
+import numpy as np
+
+import a_star
+import d_star_lite
+from test_hpa_star import calc_cost, make_map
+
+a_star.show_animation = False
+d_star_lite.show_animation = False
+
+
+def make_planners(ob):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return (a_star.AStarPlanner(ob, 1.0, 1.0),
+                d_star_lite.DStarLitePlanner(ob, 1.0, 1.0))
+
+
+def check_path(planner, reference, sx, sy, gx, gy):
+    with contextlib.redirect_stdout(io.StringIO()):
+        rx, ry = reference.planning(sx, sy, gx, gy)
+        dx, dy = planner.planning(sx, sy, gx, gy)
+    if len(rx) == 1:
+        assert (dx, dy) == (rx, ry)  # unreachable
+        return dx, dy
+    assert (dx[0], dy[0]) == (rx[0], ry[0])
+    assert (dx[-1], dy[-1]) == (rx[-1], ry[-1])
+    assert np.all(np.hypot(np.diff(dx), np.diff(dy)) < 1.5)
+    assert not np.any(planner.obstacle_map[np.asarray(dx[:-1], int),
+                                           np.asarray(dy[:-1], int)])
+    assert abs(calc_cost(dx, dy) - calc_cost(rx, ry)) < 1e-9
+    return dx, dy
+
+
+def test_costs_match_a_star():
+    rng = np.random.default_rng(6)
+    for seed in range(6):
+        planner, d_star = make_planners(make_map(seed))
+        for _ in range(8):
+            sx, sy, gx, gy = rng.integers(2, 58, 4).astype(float)
+            check_path(d_star, planner, sx, sy, gx, gy)
+
+
+def test_replanning_matches_a_star():
+    rng = np.random.default_rng(7)
+    ob = make_map(2)
+    _, d_star = make_planners(ob)
+    sx, sy, gx, gy = 5.0, 5.0, 55.0, 55.0
+    for step in range(8):
+        points = rng.uniform(2, 58, (4, 2)).round()
+        with contextlib.redirect_stdout(io.StringIO()):
+            d_star.add_obstacles(points)
+            if step % 2:
+                d_star.remove_obstacles(points[:1])
+            planner = a_star.AStarPlanner(d_star.ob, 1.0, 1.0)
+        rx, ry = check_path(d_star, planner, sx, sy, gx, gy)
+        # the robot moves a few cells along the path
+        if len(rx) > 4:
+            sx, sy = rx[-4], ry[-4]
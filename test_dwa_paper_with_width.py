@@ -0,0 +1,56 @@
+import functools
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "IntegrationTest"))
+
+import dwa_paper_with_width as dwa_width  # noqa: E402
+
+dwa_width.show_animation = False
+
+
+def make_config(**params):
+    config = dwa_width.Config()
+    # curves are checked for 10 s to keep the exact rollout quick
+    config.check_time = 10.0
+    config.collision_check = "simulate"
+    for name, value in params.items():
+        setattr(config, name, value)
+    return config
+
+
+@functools.lru_cache()
+def make_runs():
+    # a few control ticks of the exact rollout through random obstacles,
+    # at speed towards a pair ahead that the box swerves around, stopping
+    # short of it in the first run
+    config = make_config()
+    runs = []
+    for seed, ahead in ((0, 2.2), (1, 2.8)):
+        rng = np.random.default_rng(seed)
+        ob = rng.uniform(1, 9, (40, 2))
+        ob[:2] = ((ahead, ahead), (ahead + 0.3, ahead - 0.5))
+        goal = np.array([10.0, 10.0])
+        x = np.array([0.0, 0.0, math.pi / 4, 0.8, 0.0])
+        states, controls = [], []
+        for _ in range(6):
+            u, _ = dwa_width.dwa_control(x.copy(), config, goal, ob)
+            states.append(x.copy())
+            controls.append(list(u))
+            x = dwa_width.motion(x, u, config.dt)
+        runs.append((ob, goal, states, controls))
+    return runs
+
+
+def test_configuration_space_matches_exact_check():
+    config = make_config(configuration_space_yaw_bins=64)
+    for ob, goal, states, controls in make_runs():
+        ob_index = dwa_width.calc_obstacle_index(
+            ob, config, dwa_width.calc_footprint(config))
+        for x, u in zip(states, controls):
+            best_u, _ = dwa_width.dwa_control(x.copy(), config, goal, ob,
+                                              ob_index)
+            assert list(best_u) == u
@@ -0,0 +1,178 @@
+import contextlib
+import functools
+import math
+
+import numpy as np
+
+import dynamic_window_approach_paper as dwa
+
+dwa.show_animation = False
+
+
+def make_config(**params):
+    config = dwa.Config()
+    # curves are checked for 10 s to keep the per-sample loop quick
+    config.check_time = 10.0
+    config.collision_check = "simulate"
+    config.branch_and_bound = False
+    for name, value in params.items():
+        setattr(config, name, value)
+    return config
+
+
+def baseline_control(x, config, goal, ob):
+    # the per-sample loop of the original dwa_control
+    dw = dwa.calc_dynamic_window(x, config)
+    min_cost = float("inf")
+    best_u = [0.0, 0.0]
+    for v in np.arange(dw[0], dw[1], config.v_resolution):
+        for y in np.arange(dw[2], dw[3], config.yaw_rate_resolution):
+            dist, _ = dwa.closest_obstacle_on_curve(x.copy(), ob, v, y,
+                                                    config)
+            if v > math.sqrt(2*config.max_accel*dist):
+                continue
+            trajectory = dwa.predict_trajectory(x.copy(), v, y, config)
+            to_goal_cost = (config.to_goal_cost_gain
+                            * dwa.calc_to_goal_cost(trajectory, goal))
+            speed_cost = (config.speed_cost_gain
+                          * (config.max_speed - trajectory[-1, 3]))
+            if dist == 0:
+                ob_cost = float("Inf")
+            else:
+                ob_cost = config.obstacle_cost_gain * (1 / dist)
+            final_cost = to_goal_cost + speed_cost + ob_cost
+            if min_cost >= final_cost:
+                min_cost = final_cost
+                best_u = [v, y]
+                if abs(best_u[0]) < config.robot_stuck_flag_cons \
+                        and abs(x[3]) < config.robot_stuck_flag_cons:
+                    best_u[1] = -config.max_delta_yaw_rate
+    return best_u
+
+
+@functools.lru_cache()
+def make_runs():
+    # a few control ticks of the baseline through random obstacles, at
+    # speed towards a pair close ahead: the robot swerves in one run and
+    # has to stop and restart in the other
+    config = make_config()
+    runs = []
+    for seed, ahead in ((0, 1.8), (1, 1.6)):
+        rng = np.random.default_rng(seed)
+        ob = rng.uniform(1, 9, (40, 2))
+        ob[:2] = ((ahead, ahead), (ahead + 0.3, ahead - 0.5))
+        goal = np.array([10.0, 10.0])
+        x = np.array([0.0, 0.0, math.pi / 4, 0.8, 0.0])
+        states, controls = [], []
+        for _ in range(6):
+            u = baseline_control(x, config, goal, ob)
+            states.append(x.copy())
+            controls.append(u)
+            x = dwa.motion(x, u, config.dt)
+        runs.append((ob, goal, states, controls))
+    return runs
+
+
+def check_controls(config, indexed=False, cached=False, n_workers=1):
+    """
+    run dwa_control over the baseline runs, with an obstacle index, a
+    contact cache kept from tick to tick and a pool of workers if asked
+    """
+    for ob, goal, states, controls in make_runs():
+        ob_index = dwa.calc_obstacle_index(ob, config) if indexed else None
+        contact_cache = dwa.ContactCache() if cached else None
+        if n_workers > 1:
+            pool = dwa.ObstacleSearchPool(ob, config, n_workers)
+        else:
+            pool = contextlib.nullcontext()
+        with pool:
+            for x, u in zip(states, controls):
+                best_u, _ = dwa.dwa_control(
+                    x.copy(), config, goal, ob, ob_index,
+                    contact_cache=contact_cache,
+                    pool=pool if n_workers > 1 else None)
+                assert list(best_u) == u
+
+
+def test_arcs_match_stepping_for_tiny_omega():
+    config = dwa.Config()
+    n_steps = dwa.calc_n_steps(config.check_time, config.dt, inclusive=False)
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        x = np.array([*rng.uniform(-20, 20, 2), rng.uniform(-np.pi, np.pi),
+                      0.0, 0.0])
+        v = rng.uniform(0.05, 1.0)
+        omega = rng.choice([-1, 1]) * 10 ** rng.uniform(-10, -6)
+        # obstacles scattered along the nearly straight path
+        s = rng.uniform(0, 20, 20)
+        offset = rng.uniform(-1.5, 1.5, 20) * config.robot_radius
+        ob = np.stack([x[0] + s * np.cos(x[2]) - offset * np.sin(x[2]),
+                       x[1] + s * np.sin(x[2]) + offset * np.cos(x[2])],
+                      axis=1)
+
+        dist, _ = dwa.closest_obstacle_on_curve(x.copy(), ob, v, omega,
+                                                config)
+        first = dwa.first_contact_on_arcs(
+            x, ob, np.array([v]), np.array([omega]), config.dt, n_steps,
+            dwa.calc_footprint(config))
+        assert dwa.calc_contact_distances(
+            first, n_steps, np.array([v]), config.dt)[0] == dist
+
+
+def test_swept_contacts_are_never_late():
+    config = dwa.Config()
+    config.collision_check = "swept"
+    primitives = dwa.MotionPrimitives(config)
+    rng = np.random.default_rng(1)
+    ob = rng.uniform(-15, 15, (300, 2))
+    grid = dwa.calc_obstacle_index(ob, config)
+    for _ in range(10):
+        x = np.array([*rng.uniform(-10, 10, 2), rng.uniform(-np.pi, np.pi),
+                      0.0, 0.0])
+        iv = rng.integers(0, len(primitives.v), 20)
+        iw = rng.integers(0, len(primitives.omega), 20)
+        v, omega = primitives.v[iv], primitives.omega[iw]
+        dist = dwa.closest_obstacle_on_curves(x, ob, v, omega, config, grid,
+                                              primitives=primitives)
+        for i in range(len(v)):
+            exact, _ = dwa.closest_obstacle_on_curve(x.copy(), ob, v[i],
+                                                     omega[i], config)
+            assert dist[i] <= exact
+            # early contacts only come from the tables, past which the
+            # check is exact
+            if dist[i] < exact:
+                assert dist[i] <= (primitives.swept_steps[iv[i]] * v[i]
+                                   * config.dt)
+
+
+def test_analytic_check_matches_baseline():
+    check_controls(make_config(collision_check="analytic"))
+
+
+def test_vectorized_window_matches_baseline():
+    check_controls(make_config())
+    check_controls(make_config(), indexed=True)
+
+
+def test_trace_check_matches_baseline():
+    check_controls(make_config(collision_check="trace"))
+    check_controls(make_config(collision_check="trace"), indexed=True)
+
+
+def test_contact_cache_matches_baseline():
+    check_controls(make_config(collision_check="analytic"), indexed=True,
+                   cached=True)
+
+
+def test_branch_and_bound_matches_baseline():
+    check_controls(make_config(branch_and_bound=True))
+    check_controls(make_config(collision_check="analytic",
+                               branch_and_bound=True), indexed=True,
+                   cached=True)
+
+
+def test_pool_matches_baseline():
+    check_controls(make_config(collision_check="analytic"), n_workers=2)
+    check_controls(make_config(collision_check="analytic",
+                               branch_and_bound=True), indexed=True,
+                   n_workers=2)
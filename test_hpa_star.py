@@ -0,0 +1,85 @@
+import contextlib
+import io
+
+import numpy as np
+
+import a_star
+import hpa_star
+
+a_star.show_animation = False
+hpa_star.show_animation = False
+
+
+def make_map(seed):
+    # 60 m x 60 m border with a few random walls
+    rng = np.random.default_rng(seed)
+    ox, oy = [], []
+    for i in range(61):
+        ox += [i, i, 0, 60]
+        oy += [0, 60, i, i]
+    for _ in range(rng.integers(3, 9)):
+        c = rng.integers(5, 55)
+        start = rng.integers(0, 40)
+        length = rng.integers(10, 40)
+        along = list(range(start, start + length))
+        if rng.random() < 0.5:
+            ox += [c] * length
+            oy += along
+        else:
+            ox += along
+            oy += [c] * length
+    return np.array([ox, oy], dtype=float).T
+
+
+def make_planners(ob):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return (a_star.AStarPlanner(ob, 1.0, 1.0),
+                hpa_star.HPAStarPlanner(ob, 1.0, 1.0))
+
+
+def calc_cost(rx, ry):
+    return float(np.sum(np.hypot(np.diff(rx), np.diff(ry))))
+
+
+def test_cost_ratio_against_a_star():
+    rng = np.random.default_rng(0)
+    for seed in range(10):
+        planner, hpa = make_planners(make_map(seed))
+        for _ in range(10):
+            sx, sy, gx, gy = rng.integers(2, 58, 4)
+            if planner.obstacle_map[sx, sy] or planner.obstacle_map[gx, gy]:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                rx, ry = planner.planning(sx, sy, gx, gy)
+                hx, hy = hpa.planning(sx, sy, gx, gy)
+            if len(rx) == 1 and (sx, sy) != (gx, gy):
+                continue  # unreachable
+
+            assert (hx[0], hy[0]) == (gx, gy)
+            assert (hx[-1], hy[-1]) == (sx, sy)
+            assert np.all(np.hypot(np.diff(hx), np.diff(hy)) < 1.5)
+            assert not np.any(hpa.obstacle_map[np.asarray(hx[:-1], int),
+                                               np.asarray(hy[:-1], int)])
+            assert calc_cost(hx, hy) <= 1.1 * calc_cost(rx, ry) + 1e-9
+
+
+def test_obstacle_update_matches_rebuild():
+    rng = np.random.default_rng(1)
+    _, hpa = make_planners(make_map(0))
+
+    def abstract_graph(planner):
+        return (sorted((k, sorted(v)) for k, v in planner.entrances.items()),
+                sorted((k, sorted(v))
+                       for k, v in planner.cluster_nodes.items()),
+                sorted((k, sorted((m, round(c, 9)) for m, c in v))
+                       for k, v in planner.abstract_edges.items()))
+
+    for step in range(10):
+        points = rng.uniform(2, 58, (3, 2)).round()
+        with contextlib.redirect_stdout(io.StringIO()):
+            hpa.add_obstacles(points)
+            if step % 2:
+                hpa.remove_obstacles(points[:1])
+            hpa.planning(5.0, 5.0, 55.0, 55.0)
+        _, rebuilt = make_planners(hpa.ob)
+        assert abstract_graph(hpa) == abstract_graph(rebuilt)
@@ -0,0 +1,36 @@
+import contextlib
+import io
+
+import numpy as np
+
+import a_star
+import jps
+from test_hpa_star import calc_cost, make_map
+
+a_star.show_animation = False
+jps.show_animation = False
+
+
+def test_paths_match_a_star():
+    rng = np.random.default_rng(8)
+    for seed in range(8):
+        ob = make_map(seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            planner = a_star.AStarPlanner(ob, 1.0, 1.0)
+            jump = jps.JPSPlanner(ob, 1.0, 1.0)
+        for _ in range(10):
+            sx, sy, gx, gy = rng.uniform(2, 58, 4)
+            with contextlib.redirect_stdout(io.StringIO()):
+                rx, ry = planner.planning(sx, sy, gx, gy)
+                jx, jy = jump.planning(sx, sy, gx, gy)
+            if len(rx) == 1:
+                assert (jx, jy) == (rx, ry)  # unreachable
+                continue
+
+            # every cell of the path, from the goal to the start
+            assert (jx[0], jy[0]) == (rx[0], ry[0])
+            assert (jx[-1], jy[-1]) == (rx[-1], ry[-1])
+            assert np.all(np.hypot(np.diff(jx), np.diff(jy)) < 1.5)
+            assert not np.any(jump.obstacle_map[np.asarray(jx[:-1], int),
+                                                np.asarray(jy[:-1], int)])
+            assert abs(calc_cost(jx, jy) - calc_cost(rx, ry)) < 1e-9